@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""GA Benchmarks
+
+Benchmark suite for the GA in ga_hyperparameters_optimization.py, runs offline on synthetic data shaped like the Santander training data:
+
+* ~370 sparse numeric columns (mostly zeros, a mix of counts & continuous amounts)
+* 4% positive class in TARGET
+* configurable number of rows
+
+For each feature count & population size it reports the throughput of the GA operators (candidates/sec), the time of a full generation (generate, score & select) and the peak memory traced while running (per operator call, per generation for the searches - main process only, workers are not traced). Results are keyed by benchmark, population, features, generation & number of workers, so runs with other worker counts are compared separately. Results are written as JSON so a run can be compared against a saved baseline, the script exits with status 1 when a benchmark is slower than the baseline by more than the tolerance.
+
+python benchmark_ga.py --rows 5000 --features 100,370 --populations 50,200 --output bench.json
+python benchmark_ga.py --compare bench.json --tolerance 0.25
+"""
+
+import argparse
+import ast
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import types
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+PATH_GA = Path(__file__).with_name('ga_hyperparameters_optimization.py')
+
+"""The notebook script reads the Colab data files when it runs, so only its imports & definitions are loaded (imports which are not installed, e.g. plotting, are skipped). They are loaded into a module registered in sys.modules, so the functions can be pickled for the worker processes of the pool."""
+
+# Load the GA functions
+def f_load_ga(path=PATH_GA):
+    '''Module holding the imports, functions & simple settings of the notebook script'''
+    tree = ast.parse(Path(path).read_text(), filename=str(path))
+    ga = types.ModuleType('ga_hyperparameters_optimization')
+    ga.__file__ = str(path)
+    sys.modules[ga.__name__] = ga
+    ns = ga.__dict__
+    for node in tree.body:
+
+        # Imports
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            try:
+                exec(compile(ast.Module([node], type_ignores=[]), str(path), 'exec'), ns)
+            except ImportError:
+                pass
+
+        # Functions & module level dictionaries / lists / constants
+        elif isinstance(node, ast.FunctionDef) or \
+             (isinstance(node, ast.Assign) and isinstance(node.value, (ast.Dict, ast.List, ast.Constant))
+              and all(isinstance(target, ast.Name) for target in node.targets)):
+            try:
+                exec(compile(ast.Module([node], type_ignores=[]), str(path), 'exec'), ns)
+            except NameError:
+                pass
+    return ga
+
+"""**SYNTHETIC DATA**"""
+
+# Santander shaped dataset
+def f_synthetic_data(n_rows, n_features=370, p_positive=0.04, seed=1989):
+    '''Sparse numeric columns & an imbalanced binary TARGET'''
+    rng = np.random.default_rng(seed)
+
+    # Share of non-zero rows of each column (most columns are very sparse)
+    density = np.clip(rng.beta(0.4, 4, size=n_features), 0.002, 1)
+
+    # Half the columns are counts, half continuous amounts
+    data = {}
+    for j in range(n_features):
+        nonzero = rng.random(n_rows) < density[j]
+        if j % 2 == 0:
+            values = rng.poisson(rng.uniform(1, 5), size=n_rows).astype(np.float64)
+        else:
+            values = np.round(rng.lognormal(rng.uniform(3, 9), 1, size=n_rows), 2)
+        data['var' + str(j)] = np.where(nonzero, values, 0.0)
+    df = pd.DataFrame(data)
+
+    # Target driven by a few columns, intercept set so ~p_positive of rows are positive
+    informative = rng.choice(n_features, size=min(10, n_features), replace=False)
+    signal = (df.iloc[:, informative] > 0).to_numpy() @ rng.normal(0, 1.5, size=len(informative))
+    signal = signal + rng.logistic(size=n_rows)
+    df['TARGET'] = (signal > np.quantile(signal, 1 - p_positive)).astype(np.int64)
+    return df
+
+# Population with scores, similarity & probability
+def f_scored_population(ga, n_candidates, n_features, hyperparams, seed):
+    '''Random population of the size benchmarked, ready for crossover'''
+    rng = np.random.default_rng(seed)
+    features_name = pd.Index(['var' + str(j) for j in range(n_features)])
+    genomes = ga.f_random_candidates(features_name, n_candidates, hyperparams, output_type='feature')
+    values = ga.f_random_candidates(features_name, n_candidates, hyperparams, output_type='hyperparams', genomes=genomes)
+    pop = ga.f_population_create(0, np.arange(n_candidates), genomes, values)
+    pop['feature_size'] = ga.f_genome_size(pop['genomes'])
+    pop['evaluation_score'] = rng.uniform(0.5, 0.9, size=n_candidates)
+    pop['fitness_score'] = pop['evaluation_score']
+    return features_name, ga.f_sim_n_prob(pop)
+
+"""**TIMING**"""
+
+# Time a function
+def f_measure(fn, n_items, repeat):
+    '''Best & median seconds per call, items/sec & peak traced memory of a call'''
+
+    # Timing (memory tracing off)
+    fn()
+    l_seconds = []
+    for _ in range(repeat):
+        time_start = time.perf_counter()
+        fn()
+        l_seconds.append(time.perf_counter() - time_start)
+
+    # Peak memory of one call
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    v_best = min(l_seconds)
+    return {'seconds_min':v_best,
+            'seconds_median':float(np.median(l_seconds)),
+            'items':n_items,
+            'items_per_sec':n_items / v_best if v_best > 0 else float('inf'),
+            'peak_mb':peak / 2**20}
+
+# Benchmark the GA operators
+def f_bench_operators(ga, n_candidates, n_features, hyperparams, repeat, seed):
+    '''Throughput of the single candidate & whole generation operators'''
+    np.random.seed(seed)
+    features_name, pop = f_scored_population(ga, n_candidates, n_features, hyperparams, seed)
+    increment = 0.1
+
+    d_fn = {
+        'random_candidates_feature':(lambda: ga.f_random_candidates(features_name, n_candidates, hyperparams, output_type='feature')),
+        'random_candidates_hyperparams':(lambda: ga.f_random_candidates(features_name, n_candidates, hyperparams, output_type='hyperparams', genomes=pop['genomes'])),
+        'gen_child_crossover_feature':(lambda: [ga.f_gen_child_crossover(pop, features_name, hyperparams, 'feature') for _ in range(n_candidates)]),
+        'gen_child_crossover_hyperparams':(lambda: [ga.f_gen_child_crossover(pop, features_name, hyperparams, 'hyperparams') for _ in range(n_candidates)]),
+        'gen_child_mutate_feature':(lambda: [ga.f_gen_child_mutate(genome, features_name, 0.01, hyperparams, 'feature', increment) for genome in pop['genomes']]),
+        'gen_child_mutate_hyperparams':(lambda: [ga.f_gen_child_mutate(row, features_name, 0.01, hyperparams, 'hyperparams', increment) for row in pop['values']]),
+        'crossover_population':(lambda: ga.f_crossover_population(pop['genomes'], pop['values'], pop['probability'], n_candidates, n_candidates, hyperparams)),
+        'mutate_population':(lambda: ga.f_mutate_population(pop['genomes'], pop['values'], 0.01, hyperparams, increment)),
+        'sim_n_prob':(lambda: ga.f_sim_n_prob(dict(pop))),
+        'sim_n_prob_pairwise':(lambda: ga.f_sim_n_prob(dict(pop), pairwise=True)),
+    }
+
+    l_results = []
+    for name, fn in d_fn.items():
+        result = f_measure(fn, n_candidates, repeat)
+        l_results.append(dict(result, benchmark=name, population=n_candidates, features=n_features))
+    return l_results
+
+# Benchmark whole generations
+def f_bench_generations(ga, df, n_candidates, generations, hyperparams, hyperparams_multiple, n_workers, seed):
+    '''Time, candidates scored per second & peak traced memory of each generation of a short search'''
+    np.random.seed(seed)
+
+    # Fitness proportional selection needs a positive metric, so a classifier scored by AUC
+    stream = ga.f_model_optimisation_stream(df=df, target_var='TARGET', generations=generations, population=n_candidates,
+                                            eval_metric='roc_auc', model=make_pipeline(StandardScaler(), LogisticRegression()), kfold=False,
+                                            hyperparams_multiple=hyperparams_multiple, hyperparams=hyperparams,
+                                            elitism=1, n_workers=n_workers, seed=seed, keep_history=False)
+
+    # Collect the generation records (the peak is reset after each record so it covers one generation of the main process)
+    tracemalloc.start()
+    l_results = []
+    for record in stream:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        n_variants = n_candidates * hyperparams_multiple
+        l_results.append({'benchmark':'generation',
+                          'generation':record['generation'],
+                          'population':n_candidates,
+                          'features':df.shape[1] - 1,
+                          'rows':len(df),
+                          'n_workers':n_workers,
+                          'seconds_min':record['time']['total'],
+                          'seconds_median':record['time']['total'],
+                          'items':n_variants,
+                          'items_per_sec':n_variants / record['time']['total'],
+                          'time':record['time'],
+                          'cache_hit_rate':record['cache']['hit_rate'] if record['cache'] != False else None,
+                          'peak_mb':peak / 2**20})
+    tracemalloc.stop()
+    return l_results
+
+"""**REGRESSIONS**"""
+
+# Key of a benchmark result
+def f_result_key(result):
+    '''Benchmark, population, features, generation & number of workers (1 for the operators)'''
+    return (result['benchmark'], result['population'], result['features'], result.get('generation'), result.get('n_workers', 1))
+
+# Compare against a baseline
+def f_compare(l_results, l_baseline, tolerance):
+    '''Benchmarks slower than the baseline by more than the tolerance'''
+    d_baseline = {f_result_key(result):result for result in l_baseline}
+    l_regressions = []
+    for result in l_results:
+        baseline = d_baseline.get(f_result_key(result))
+        if baseline is None:
+            continue
+        v_ratio = result['seconds_min'] / max(baseline['seconds_min'], 1e-12)
+        if v_ratio > 1 + tolerance:
+            l_regressions.append({'key':list(f_result_key(result)),
+                                  'seconds':result['seconds_min'],
+                                  'baseline_seconds':baseline['seconds_min'],
+                                  'ratio':v_ratio})
+    return l_regressions
+
+# Comma separated integers
+def f_int_list(text):
+    return [int(v) for v in text.split(',') if v != '']
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the GA operators & generations on synthetic Santander shaped data')
+    parser.add_argument('--rows', type=int, default=5000, help='rows of the synthetic dataset')
+    parser.add_argument('--features', type=f_int_list, default=[370], help='feature counts, e.g. 100,370')
+    parser.add_argument('--populations', type=f_int_list, default=[50, 200], help='population sizes, e.g. 50,200')
+    parser.add_argument('--generations', type=int, default=3, help='generations of the end to end runs (0 to skip)')
+    parser.add_argument('--hyperparams-multiple', type=int, default=3)
+    parser.add_argument('--n-workers', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5, help='timed repeats of each operator')
+    parser.add_argument('--seed', type=int, default=1989)
+    parser.add_argument('--output', default=None, help='JSON file to write (stdout if not given)')
+    parser.add_argument('--compare', default=None, help='baseline JSON file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slow down against the baseline')
+    args = parser.parse_args(argv)
+
+    ga = f_load_ga()
+    hyperparams = {'names':['alpha', 'l1_ratio'], 'min_value':[0.0001, 0.0001], 'max_value':[1, 1], 'type':['float', 'float']}
+    hyperparams_model = {'names':['logisticregression__C'], 'min_value':[0.001], 'max_value':[1], 'type':['float']}
+
+    # Operators
+    l_results = []
+    for n_features in args.features:
+        for n_candidates in args.populations:
+            l_results += f_bench_operators(ga, n_candidates, n_features, hyperparams, args.repeat, args.seed)
+            print('operators - features:' + str(n_features) + ' - population:' + str(n_candidates), file=sys.stderr)
+
+    # Whole generations
+    if args.generations > 0:
+        for n_features in args.features:
+            df = f_synthetic_data(args.rows, n_features=n_features, seed=args.seed)
+            for n_candidates in args.populations:
+                l_results += f_bench_generations(ga, df, n_candidates, args.generations, hyperparams_model,
+                                                 args.hyperparams_multiple, args.n_workers, args.seed)
+                print('generations - features:' + str(n_features) + ' - population:' + str(n_candidates), file=sys.stderr)
+
+    output = {'meta':{'python':platform.python_version(),
+                      'numpy':np.__version__,
+                      'pandas':pd.__version__,
+                      'sklearn':sklearn.__version__,
+                      'machine':platform.machine(),
+                      'rows':args.rows,
+                      'seed':args.seed},
+              'results':l_results}
+
+    # Regressions against the baseline
+    if args.compare is not None:
+        l_baseline = json.loads(Path(args.compare).read_text())['results']
+        output['regressions'] = f_compare(l_results, l_baseline, args.tolerance)
+
+    text = json.dumps(output, indent=1, default=float)
+    if args.output is not None:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+
+    if len(output.get('regressions', [])) > 0:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
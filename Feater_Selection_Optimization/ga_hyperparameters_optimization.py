@@ -30,8 +30,28 @@ import numpy as np
 import pandas as pd 
 import numpy.random as rnd 
 from scipy import spatial
-
-from sklearn.model_selection import train_test_split, cross_val_score, KFold
+from scipy import stats
+from collections import OrderedDict
+import os
+import json
+import hashlib
+import shutil
+import pickle
+import time
+import traceback
+import warnings
+import joblib
+import tracemalloc
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from sklearn.model_selection import train_test_split, cross_val_score, KFold, StratifiedKFold, check_cv
+from sklearn.base import clone, is_classifier
+from sklearn import config_context
+from sklearn.metrics import get_scorer
+from sklearn.utils.multiclass import type_of_target
+from sklearn.exceptions import FitFailedWarning
 from sklearn.preprocessing import MinMaxScaler, StandardScaler
 from sklearn.pipeline import Pipeline
 from sklearn.compose import ColumnTransformer
@@ -40,9 +60,10 @@ from sklearn import metrics
 
 
 from sklearn.neighbors import KNeighborsClassifier
-from sklearn.linear_model import ElasticNet
-from sklearn.ensemble import RandomForestClassifier
-from xgboost import XGBClassifier
+from sklearn.linear_model import ElasticNet, Lasso, enet_path
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+import xgboost as xgb
+from xgboost import XGBClassifier, XGBModel, QuantileDMatrix
 
 #from sklearn.utils.testing import ignore_warnings
 #from sklearn.exceptions import ConvergenceWarning
@@ -52,8 +73,114 @@ import matplotlib.pyplot as plt
 from matplotlib.ticker import MaxNLocator
 import seaborn as sns
 
-df_train = pd.read_csv("/content/drive/MyDrive/GA_Project/Feature_Selection+Optimization/dataset/train.csv", index_col = "ID")
-df_test = pd.read_csv("/content/drive/MyDrive/GA_Project/Feature_Selection+Optimization/dataset/test.csv", index_col = "ID")
+"""**DATASET CACHE**
+
+Parsing the CSV files and converting the text to numbers takes most of the loading time, so the first load converts each CSV to a binary cache which every later load (and every worker process) maps instead of parsing. The cache is a directory next to the CSV holding:
+
+1. One column-major .npy file per data type, every column stored in the smallest type that holds its values exactly (integers in int8 - int64, decimals in float32 if no value changes, otherwise float64)
+2. The index in its own .npy file & the non-numeric columns (if any) pickled
+3. A meta.json file with the column order, the data type of each column & the size and modification time of the CSV
+
+The .npy files are memory mapped read only, so loading takes no time, the columns are only read from disk when used and processes on the same machine share one copy in the page cache. The cache is rebuilt when the CSV changes.
+"""
+
+# Smallest data type holding every value exactly
+def f_downcast(values):
+    '''Values as the smallest integer type, otherwise float32 if no value changes, otherwise unchanged'''
+    if values.dtype.kind not in 'iuf' or len(values) == 0:
+        return values
+    
+    # Whole numbers (including whole numbers stored as decimals)
+    if np.issubdtype(values.dtype, np.integer) or (np.isfinite(values).all() and (values == np.round(values)).all()):
+        v_min, v_max = values.min(), values.max()
+        for dtype in [np.int8, np.int16, np.int32, np.int64]:
+            if np.iinfo(dtype).min <= v_min and v_max <= np.iinfo(dtype).max:
+                return values.astype(dtype)
+    
+    # Decimals
+    if values.dtype == np.float64:
+        values_32 = values.astype(np.float32)
+        if np.array_equal(values_32.astype(np.float64), values, equal_nan=True):
+            return values_32
+    return values
+
+# Write a data frame to the binary cache
+def f_frame_save(df, cache_dir, meta):
+    '''Write the columns of the data frame to one column-major .npy file per data type'''
+    meta = dict(meta, index=(df.index.name is not None) or not df.index.equals(pd.RangeIndex(len(df))), index_name=df.index.name, columns=[])
+    
+    # Group numeric columns by their smallest data type
+    d_groups = OrderedDict()
+    l_object = []
+    for col in df.columns:
+        if pd.api.types.is_numeric_dtype(df[col]):
+            values = f_downcast(df[col].to_numpy())
+            group = d_groups.setdefault(values.dtype.name, [])
+            meta['columns'].append([col, values.dtype.name, len(group)])
+            group.append(values)
+        else:
+            l_object.append(col)
+            meta['columns'].append([col, 'object', -1])
+    
+    # Write to a temporary directory then rename over the previous cache
+    cache_tmp = cache_dir + '.tmp'
+    if os.path.isdir(cache_tmp):
+        shutil.rmtree(cache_tmp)
+    os.makedirs(cache_tmp)
+    for dtype, group in d_groups.items():
+        np.save(os.path.join(cache_tmp, dtype + '.npy'), np.asfortranarray(np.column_stack(group)))
+    if meta['index']:
+        np.save(os.path.join(cache_tmp, 'index.npy'), f_downcast(df.index.to_numpy()), allow_pickle=True)
+    if len(l_object) > 0:
+        df[l_object].to_pickle(os.path.join(cache_tmp, 'object.pkl'))
+    with open(os.path.join(cache_tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    if os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.replace(cache_tmp, cache_dir)
+
+# Read a data frame from the binary cache
+def f_frame_load(cache_dir):
+    '''Data frame backed by read only memory maps of the .npy files'''
+    with open(os.path.join(cache_dir, 'meta.json')) as f:
+        meta = json.load(f)
+    
+    # Map each data type & wrap the columns without copying
+    l_frames = []
+    for dtype in OrderedDict.fromkeys(dtype for col, dtype, pos in meta['columns'] if dtype != 'object'):
+        arr = np.load(os.path.join(cache_dir, dtype + '.npy'), mmap_mode='r')
+        l_frames.append(pd.DataFrame(arr, columns=[col for col, col_dtype, pos in meta['columns'] if col_dtype == dtype], copy=False))
+    if any(dtype == 'object' for col, dtype, pos in meta['columns']):
+        l_frames.append(pd.read_pickle(os.path.join(cache_dir, 'object.pkl')).reset_index(drop=True))
+    df = pd.concat(l_frames, axis=1)[[col for col, dtype, pos in meta['columns']]]
+    
+    # Index
+    if meta['index']:
+        df.index = pd.Index(np.load(os.path.join(cache_dir, 'index.npy'), allow_pickle=True), name=meta['index_name'])
+    return df
+
+# Load a CSV file through the binary cache
+def f_load_dataset(path_csv, index_col=None, cache_dir=False):
+    '''Data frame of the CSV backed by read only memory maps of the binary cache (built on first use)'''
+    if cache_dir == False:
+        cache_dir = os.path.splitext(path_csv)[0] + '_cache'
+    
+    # Build the cache if missing, stale or for another index column
+    path_meta = os.path.join(cache_dir, 'meta.json')
+    meta = False
+    if os.path.isfile(path_meta):
+        with open(path_meta) as f:
+            meta = json.load(f)
+    if (meta == False or meta['index_col'] != index_col or
+        (os.path.isfile(path_csv) and meta['source'] != [os.path.getsize(path_csv), os.stat(path_csv).st_mtime_ns])):
+        f_frame_save(pd.read_csv(path_csv, index_col=index_col), cache_dir, 
+                     {'source':[os.path.getsize(path_csv), os.stat(path_csv).st_mtime_ns], 'index_col':index_col})
+    
+    # Return
+    return f_frame_load(cache_dir)
+
+df_train = f_load_dataset("/content/drive/MyDrive/GA_Project/Feature_Selection+Optimization/dataset/train.csv", index_col = "ID")
+df_test = f_load_dataset("/content/drive/MyDrive/GA_Project/Feature_Selection+Optimization/dataset/test.csv", index_col = "ID")
 
 """The shape of the training data file. TARGET values portion, 0 - 96% & 1 - 4% """
 
@@ -72,98 +199,303 @@ df_train.var3.describe()
 
 display(df_train['var3'].value_counts(normalize=True)[0:3])
 df_train['var3'] = df_train['var3'].replace(-999999,2)
+df_test['var3'] = df_test['var3'].replace(-999999,2)
 
 df_train, df_val = train_test_split(df_train, test_size=0.2, random_state = 1989, stratify = df_train.TARGET, shuffle = True)
-kfold = KFold(n_splits=5, random_state = 1989, shuffle = True) # 5-cross validation
+kfold = StratifiedKFold(n_splits=5, random_state = 1989, shuffle = True) # 5-cross validation (stratified, TARGET is imbalanced)
 
 fts_num = df_train.drop(axis =1, columns = ['TARGET']).select_dtypes(np.number).columns
 print(fts_num)
 
-#Standardisation and range scaler
-fts_num = df_train.drop(axis =1, columns = ['TARGET']).select_dtypes(np.number).columns
-transformed_num = Pipeline(steps = [('Standarise', StandardScaler()), ('MinMax', MinMaxScaler())])
+"""**PREPROCESSING**
 
-preprocessor_preds = ColumnTransformer(transformers = [('num', transformed_num, fts_num)]) #cenre, scale, constrain range
+Every numeric feature is standardised then range scaled. The preprocessor is fitted once, on the training split only, and the validation & test splits are only transformed with the fitted parameters (fitting on them would leak their distribution into the model). The fitted preprocessor (joblib) & the transformed splits (binary cache, as for the datasets) are saved to a cache directory with a hash of each input split, so later sessions load the transformed splits instead of repeating the work. The cache is rebuilt when any input split changes.
+"""
 
-#Transformation on training data
-df_train_2 = pd.DataFrame(preprocessor_preds.fit_transform(df_train))
-df_train_2.columns = fts_num
+# Hash of a data frame
+def f_frame_fingerprint(df):
+    '''Hash of the column names, index & values'''
+    digest = hashlib.sha1(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    digest.update(json.dumps([str(col) for col in df.columns]).encode())
+    return digest.hexdigest()
+
+# Fit the preprocessor
+def f_preprocess_fit(df, target_var):
+    '''Standardise then range scale every numeric feature, fitted on df only'''
+    fts_num = df.drop(columns = [target_var]).select_dtypes(np.number).columns
+    transformed_num = Pipeline(steps = [('Standarise', StandardScaler()), ('MinMax', MinMaxScaler())])
+    preprocessor = ColumnTransformer(transformers = [('num', transformed_num, fts_num)]) #cenre, scale, constrain range
+    return preprocessor.fit(df)
+
+# Apply the fitted preprocessor
+def f_preprocess_transform(preprocessor, df):
+    '''Transformed numeric features followed by the other columns (index reset)'''
+    fts_num = preprocessor.transformers_[0][2]
+    df_num = pd.DataFrame(preprocessor.transform(df), columns=fts_num)
+    return pd.concat([df_num, df.drop(columns=fts_num).reset_index(drop=True)], axis = 1)
+
+# Preprocess the splits through the cache
+def f_preprocess(d_frames, target_var, fit='train', cache_dir=False):
+    '''Splits transformed by a preprocessor fitted once on the fit split & the preprocessor (loaded from the cache if the splits are unchanged)'''
+    d_fingerprint = {name:f_frame_fingerprint(df) for name, df in d_frames.items()}
+    
+    # Load the cached splits
+    if cache_dir != False and os.path.isfile(os.path.join(cache_dir, 'meta.json')):
+        with open(os.path.join(cache_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['fingerprint'] == d_fingerprint and meta['fit'] == fit and meta['target_var'] == target_var:
+            return ({name:f_frame_load(os.path.join(cache_dir, name)) for name in d_frames}, 
+                    joblib.load(os.path.join(cache_dir, 'preprocessor.joblib')))
+    
+    # Fit on one split, transform every split
+    preprocessor = f_preprocess_fit(d_frames[fit], target_var)
+    d_output = {name:f_preprocess_transform(preprocessor, df) for name, df in d_frames.items()}
+    
+    # Write to a temporary directory then rename over the previous cache (the splits are then read back memory mapped)
+    if cache_dir != False:
+        cache_tmp = cache_dir + '.tmp'
+        if os.path.isdir(cache_tmp):
+            shutil.rmtree(cache_tmp)
+        os.makedirs(cache_tmp)
+        joblib.dump(preprocessor, os.path.join(cache_tmp, 'preprocessor.joblib'))
+        for name, df in d_output.items():
+            f_frame_save(df, os.path.join(cache_tmp, name), {'source':d_fingerprint[name]})
+        with open(os.path.join(cache_tmp, 'meta.json'), 'w') as f:
+            json.dump({'fingerprint':d_fingerprint, 'fit':fit, 'target_var':target_var}, f)
+        if os.path.isdir(cache_dir):
+            shutil.rmtree(cache_dir)
+        os.replace(cache_tmp, cache_dir)
+        d_output = {name:f_frame_load(os.path.join(cache_dir, name)) for name in d_frames}
+    
+    # Return
+    return d_output, preprocessor
 
-#Transformation on validation set
-df_val_2 = pd.DataFrame(preprocessor_preds.fit_transform(df_val))
-df_val_2.columns = fts_num
+#Standardisation and range scaler, fitted on the training data only (validation & test are transformed)
+d_preprocessed, preprocessor_preds = f_preprocess({'train':df_train, 'val':df_val, 'test':df_test}, target_var='TARGET', fit='train',
+                                                  cache_dir="/content/drive/MyDrive/GA_Project/Feature_Selection+Optimization/dataset/preprocessed_cache")
 
-#Transformation on test set
-df_test_2 = pd.DataFrame(preprocessor_preds.fit_transform(df_test))
-df_test_2.columns = fts_num
+#TRAINING DATA, VALIDATION DATA & TEST DATA
+df_train, df_val, df_test = d_preprocessed['train'], d_preprocessed['val'], d_preprocessed['test']
 
-#Concatenate preprocessed data
+#FAKA KORO
+del d_preprocessed, fts_num, preprocessor_preds
 
-#TRAINING DATA
-df_train = pd.concat([df_train_2, df_train.drop(axis=1, columns=fts_num).reset_index().drop(axis=1, columns=['ID'])], axis = 1)
+"""OPTIMIZATION(ga)"""
 
-#VALIDATION DATA
-df_val = pd.concat([df_val_2, df_val.drop(axis=1, columns=fts_num).reset_index().drop(axis=1, columns=['ID'])], axis = 1)
+"""**PREFILTER**
 
-# TEST DATA
-df_test = pd.concat([df_test_2, df_test.drop(axis=1, columns=fts_num).reset_index().drop(axis=1, columns=['ID'])], axis = 1)
+Constant, duplicated & highly correlated columns add nothing a model can use but they lengthen every genome and every matrix a model is fitted on. The prefilter removes them once before the search starts:
 
-#FAKA KORO
-del df_train_2, df_val_2, df_test_2, fts_num, transformed_num, preprocessor_preds
+1. Constant (or near constant) columns - variance at or below the variance threshold (VarianceThreshold)
+2. Duplicated columns - columns with the same hash of their values are compared & only the first of identical columns is kept
+3. Correlated columns - of each pair of columns with an absolute correlation above the correlation threshold only the first is kept
 
-"""OPTIMIZATION(ga)"""
+The search then runs on the kept columns and the feature positions in the output are mapped back so they still refer to the columns of the original data. The prefilter is a setting of f_model_optimisation_stream (the records, migrants & history it hands out are over the original columns), f_model_optimisation & f_island_optimisation (applied once before the islands start).
+"""
+
+# Columns kept by the prefilter
+def f_prefilter_features(features, variance=0, correlation=0.99):
+    '''Positions of the columns kept & the number of columns dropped by each step'''
+    X = np.asarray(features, dtype=np.float64)
+    d_dropped = {'constant':0, 'duplicate':0, 'correlated':0}
+    
+    # Constant columns
+    idx_keep = np.flatnonzero(VarianceThreshold(threshold=variance).fit(X).get_support())
+    d_dropped['constant'] = X.shape[1] - len(idx_keep)
+    
+    # Duplicated columns (hash the values of each column, confirm equal hashes element by element)
+    d_seen = {}
+    l_keep = []
+    for idx in idx_keep:
+        column = np.ascontiguousarray(X[:, idx])
+        l_same = d_seen.setdefault(hash(column.tobytes()), [])
+        if any(np.array_equal(column, X[:, idx_same], equal_nan=True) for idx_same in l_same):
+            d_dropped['duplicate'] += 1
+        else:
+            l_same.append(idx)
+            l_keep.append(idx)
+    idx_keep = np.array(l_keep, dtype=np.int64)
+    
+    # Correlated columns (keep the first column of each correlated pair)
+    if (correlation != False) and (len(idx_keep) > 1):
+        corr = np.abs(np.corrcoef(X[:, idx_keep], rowvar=False))
+        np.fill_diagonal(corr, 0)
+        keep = np.ones(len(idx_keep), dtype=bool)
+        for i in range(len(idx_keep)):
+            if keep[i]:
+                keep[i+1:] &= ~(corr[i, i+1:] > correlation)
+        d_dropped['correlated'] = int((~keep).sum())
+        idx_keep = idx_keep[keep]
+    
+    # Return
+    return idx_keep, d_dropped
+
+# Prefilter the data of a search
+def f_prefilter_apply(df, target_var, prefilter, initalise=False):
+    '''Dataframe of the kept columns & the target, the initial solution on the kept columns & the positions of the kept columns'''
+    features = df.drop(target_var, axis=1)
+    idx_keep, d_dropped = f_prefilter_features(features, variance=prefilter.get('variance', 0), correlation=prefilter.get('correlation', 0.99))
+    print('Prefilter - Constant:' + str(d_dropped['constant']) +
+          ' - Duplicate:' + str(d_dropped['duplicate']) +
+          ' - Correlated:' + str(d_dropped['correlated']) +
+          ' - Kept:' + str(len(idx_keep)) + '/' + str(features.shape[1]))
+    df = df[list(features.columns[idx_keep]) + [target_var]]
+    if initalise != False:
+        initalise = dict(initalise, features=np.flatnonzero(np.isin(idx_keep, initalise['features'])))
+    return df, initalise, idx_keep
+
+# Genomes over the original columns
+def f_prefilter_genomes(genomes, idx_keep, n_features):
+    '''Genome matrix over every column of the original data (the dropped columns are never selected)'''
+    genomes_full = np.zeros((len(genomes), n_features), dtype=bool)
+    genomes_full[:, idx_keep] = genomes
+    return genomes_full
+
+"""**GENOME**
+
+The features of a candidate are stored as a genome - a boolean mask with one flag per column - rather than a list of column positions. Converting between the two is a single indexing operation, crossover and mutation work on the mask directly and, for the set based measures (feature size & Jaccard similarity), genomes are packed into 64 bit words so they come from popcounts.
+"""
 
-def f_random_candidates(features_name, population, hyperparams, output_type, df_pop=False):
+# Convert feature positions into a genome
+def f_genome_from_idx(feature_idx, n_features):
+    '''Boolean mask of the selected features'''
+    genome = np.zeros(n_features, dtype=bool)
+    genome[np.asarray(feature_idx, dtype=np.int64)] = True
+    return genome
+
+# Convert a genome into feature positions
+def f_genome_to_idx(genome):
+    '''Positions of the selected features'''
+    return np.flatnonzero(genome)
+
+# Pack genomes into 64 bit words
+def f_genome_pack(genome):
+    '''Bitset of one genome or a matrix of genomes (one row each)'''
+    genome = np.atleast_2d(genome)
+    n_words = -(-genome.shape[1] // 64)
+    packed = np.packbits(genome, axis=1, bitorder='little')
+    packed = np.pad(packed, ((0, 0), (0, n_words * 8 - packed.shape[1])))
+    return packed.view(np.uint64)
+
+# Count set bits of packed genomes
+def f_popcount(words):
+    '''Number of set bits in each row of packed genomes'''
+    words = np.atleast_2d(words)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int64)
+    return np.unpackbits(words.view(np.uint8), axis=1).sum(axis=1, dtype=np.int64)
+
+# Number of features in a genome
+def f_genome_size(genome):
+    '''Feature size of one genome or each row of a matrix of genomes'''
+    return np.count_nonzero(genome, axis=-1)
+
+# Jaccard similarity of genomes
+def f_genome_jaccard(genome1, genome2):
+    '''Intersection over union of the selected features'''
+    words1 = f_genome_pack(genome1)
+    words2 = f_genome_pack(genome2)
+    v_union = f_popcount(words1 | words2)
+    v_intersection = f_popcount(words1 & words2)
+    return np.where(v_union > 0, v_intersection / np.maximum(v_union, 1), 1.0)
+
+"""**RANDOM STREAMS**
+
+By default the GA draws from the global numpy.random state, so a run depends on everything else which uses it. When a seed is given every random draw comes from an np.random.Generator on its own stream instead, addressed by position in the SeedSequence spawn tree of the seed:
+
+* (generation,) - draws for the generation as a whole, e.g. the candidates which survive without crossover
+* (generation, candidate) - draws which create one candidate, its parents, crossover point & mutations (all variants of a candidate share its stream)
+* the root of the tree - draws for the run as a whole, e.g. the fidelity subsamples
+
+A candidate therefore only depends on the seed, its generation & its number, not on the order in which candidates are created or scored, so serial, multi-process & resumed runs with the same seed produce identical populations. With streams=False the helpers below fall back to the global state.
+"""
+
+# Generator of a stream of the seed
+def f_rng(seed, *key):
+    '''np.random.Generator at position key of the spawn tree (same as SeedSequence(seed).spawn at each level)'''
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=key))
+
+# Streams of a generation
+def f_rng_generation(seed, generation, n_candidates):
+    '''Generator of the generation & one per candidate'''
+    return {'generation':f_rng(seed, generation),
+            'candidate':[f_rng(seed, generation, candidate) for candidate in range(n_candidates)]}
+
+# Uniform random numbers
+def f_random_rows(streams, rows, size=()):
+    '''Array of shape (rows,) + size, row i drawn from streams[rows[i]] (global state if streams is False)'''
+    size = tuple(size)
+    if streams == False:
+        return rnd.random_sample((len(rows),) + size)
+    return np.array([streams[row].random(size) for row in rows], dtype=np.float64).reshape((len(rows),) + size)
+
+# Random integers
+def f_integers_rows(streams, rows, high):
+    '''One integer in [0, high) per row, row i drawn from streams[rows[i]] (global state if streams is False)'''
+    if streams == False:
+        return rnd.randint(low=0, high=high, size=len(rows))
+    return np.array([streams[row].integers(0, high) for row in rows], dtype=np.int64)
+
+def f_random_candidates(features_name, population, hyperparams, output_type, genomes=False, streams=False, rows=False):
     '''create an initial population'''
+    
+    # Stream of each candidate (rows of the hyperparameter matrix can share a candidate)
+    if rows is False:
+        rows = np.arange(population)
    
     # Create solution for features
     if output_type == 'feature':
         
         # Initial population will have between 10-91% of features
-        feature_size = rnd.choice(a=range(10,91),size=population, replace=True)
+        if streams == False:
+            feature_size = rnd.choice(a=range(10,91),size=population, replace=True)
+        else:
+            feature_size = [streams[row].choice(a=range(10,91)) for row in rows]
         feature_size = [np.round(pct / 100 * len(features_name)) for pct in feature_size]
         
         # Create a list of feature positions for each candidate
-        selection = [rnd.choice(a=range(0,len(features_name)-1), replace=False, size=cols.astype('int')) \
-                     for cols in feature_size]
+        if streams == False:
+            selection = [rnd.choice(a=range(0,len(features_name)-1), replace=False, size=cols.astype('int')) \
+                         for cols in feature_size]
+        else:
+            selection = [streams[row].choice(a=range(0,len(features_name)-1), replace=False, size=cols.astype('int')) \
+                         for row, cols in zip(rows, feature_size)]
         
-        selection = [list(selection[i]) for i in range(len(selection))]
+        # Convert to a (population, features) genome matrix
+        genomes = np.zeros((population, len(features_name)), dtype=bool)
+        for i in range(len(selection)):
+            genomes[i, selection[i]] = True
         
         # Return
-        return selection
+        return genomes
     
     # Create solution for hyperparameters
     elif (output_type == 'hyperparams') & (hyperparams != False):
         
         # Generate random numbers in range for each hyperparameter
-        random_hyperparams = []
+        values = np.empty((population, len(hyperparams['names'])))
+        if streams != False:
+            uniform = f_random_rows(streams, rows, (len(hyperparams['names']),))
         for j in range(len(hyperparams['names'])):
-            temp = (np.random.uniform(hyperparams['min_value'][j],
-                                      hyperparams['max_value'][j],
-                                      population))
-            random_hyperparams.append(temp)
-        
-        # Get length of features
-        n_features = df_pop['features'].apply(len).tolist()
-
-        # Store hyperparameters in diction
-        hyperparam_vals = []
-        for i in range(population):
-            val = {'name':[],'value':[]}
-            for j in range(len(hyperparams['names'])):
-                val['name'].append(hyperparams['names'][j])
-                temp = random_hyperparams[j][i]
-                if hyperparams['type'][j] == 'int':
-                    temp = np.int64(round(temp))
-                if hyperparams['names'][j] == 'max_features':
-                    temp = min(temp, n_features[i])
-                val['value'].append(temp)           
+            if streams == False:
+                values[:, j] = np.random.uniform(hyperparams['min_value'][j],
+                                                 hyperparams['max_value'][j],
+                                                 population)
+            else:
+                values[:, j] = hyperparams['min_value'][j] + (hyperparams['max_value'][j] - hyperparams['min_value'][j]) * uniform[:, j]
             
-            hyperparam_vals.append(val)
-            del val
+            # Integer parameters & limit max_features to the size of the genome
+            if hyperparams['type'][j] == 'int':
+                values[:, j] = np.round(values[:, j])
+            if hyperparams['names'][j] == 'max_features':
+                values[:, j] = np.minimum(values[:, j], f_genome_size(genomes))
 
         # Return
-        return hyperparam_vals
+        return values
+    
+    # No hyperparameters to tune
+    else:
+        return np.empty((population, 0))
 
 """**CROSSOVER** 
 
@@ -186,25 +518,19 @@ def f_gen_child_crossover(df, features_name, hyperP, output_type):
     # Crossover features
     if output_type == 'feature':
         
-        # Create an integer list of features
-        l_features = list(range(0,len(features_name)))
-        cross_point = np.int(rnd.randint(low=0, high=len(features_name), size=1))
+        # Crossover point
+        cross_point = int(rnd.randint(low=0, high=len(features_name), size=1)[0])
         
         # Extract Two Parents
-        selection = np.random.choice(df.features, 
+        selection = np.random.choice(len(df['genomes']), 
                                      size=2, 
                                      replace=False, 
-                                     p=df.probability)     
-        par1 = list(selection[0])
-        par2 = list(selection[1])
-            
-        # Convert to Boolean
-        par1 = [item in par1 for item in l_features]
-        par2 = [item in par2 for item in l_features]
+                                     p=df['probability'])     
+        par1 = df['genomes'][selection[0]]
+        par2 = df['genomes'][selection[1]]
         
-        # Single point cross over and convert to indices
-        child = par1[0:cross_point] + par2[cross_point:]
-        child = [i for i,x in enumerate(child) if x == True]    
+        # Single point cross over of the genomes
+        child = np.concatenate([par1[0:cross_point], par2[cross_point:]])
         
         return child   
   
@@ -212,23 +538,69 @@ def f_gen_child_crossover(df, features_name, hyperP, output_type):
         # Identify the number of parameters
         n_hyperP = len(hyperP['min_value'])
         # Extract n Parents
-        selection = np.random.choice(df.hyperparameters, 
+        selection = np.random.choice(len(df['values']), 
                                      size=n_hyperP, 
                                      replace=False, 
-                                     p=df.probability)  
+                                     p=df['probability'])  
         
         # Randomly choose which parent to select each parameter from
         parent_choice = list(np.random.choice(range(n_hyperP),
                                               size = n_hyperP,
                                               replace=False))        
         # Copy the parent as the child
-        child = selection[0]
+        child = df['values'][selection[0]].copy()
         # Update child vector with choosen parent
         for i in range(n_hyperP):
-            child['value'][i] = selection[parent_choice[i]]['value'][i]
+            child[i] = df['values'][selection[parent_choice[i]]][i]
 
         return child
 
+"""Crossover can also produce a whole generation in one call. All parents are drawn at once by weighted sampling without replacement (each row of random keys log(p) + Gumbel noise is ranked, which gives the same distribution as drawing the parents one at a time with the selection probability), then:
+
+1. Child genomes take the first parent's flags before their cut point and the second parent's after it (a masked selection over the genome matrix)
+2. Child hyperparameters take each value from one of their parents, using a random permutation per child to index a 2-D value array
+"""
+
+# Weighted sampling of parents for many children at once
+def f_sample_parents(probability, n_children, n_parents, streams=False, rows=False):
+    '''(children, parents) positions sampled without replacement'''
+    if rows is False:
+        rows = np.arange(n_children)
+    
+    # Gumbel keys, the largest n_parents in each row are the parents
+    with np.errstate(divide='ignore'):
+        keys = np.log(np.asarray(probability, dtype=np.float64)) - np.log(-np.log(f_random_rows(streams, rows, (len(probability),))))
+    parents = np.argpartition(-keys, n_parents - 1, axis=1)[:, :n_parents]
+    
+    # Order the parents by their key
+    order = np.argsort(-np.take_along_axis(keys, parents, axis=1), axis=1)
+    return np.take_along_axis(parents, order, axis=1)
+
+# Crossover a whole generation
+def f_crossover_population(genomes, values, probability, n_children, n_children_hyperP, hyperP, streams=False):
+    '''Create the genome and hyperparameter matrices of the crossover children (child i drawn from streams[i])'''
+    
+    # Features - single point crossover of two parents
+    n_features = genomes.shape[1]
+    rows = np.arange(n_children)
+    parents = f_sample_parents(probability, n_children, 2, streams=streams, rows=rows)
+    cross_point = f_integers_rows(streams, rows, n_features)
+    before_cross = np.arange(n_features) < cross_point[:, None]
+    child_genomes = np.where(before_cross, genomes[parents[:, 0]], genomes[parents[:, 1]])
+    
+    # Hyperparameters - each value from one of n parents
+    if hyperP != False:
+        n_hyperP = values.shape[1]
+        rows = np.arange(n_children_hyperP) * n_children // max(n_children_hyperP, 1)
+        parents = f_sample_parents(probability, n_children_hyperP, n_hyperP, streams=streams, rows=rows)
+        parent_choice = np.argsort(f_random_rows(streams, rows, (n_hyperP,)), axis=1)
+        parent_choice = np.take_along_axis(parents, parent_choice, axis=1)
+        child_values = values[parent_choice, np.arange(n_hyperP)]
+    else:
+        child_values = np.empty((n_children_hyperP, 0))
+    
+    return child_genomes, child_values
+
 """**MUTATION**
 
 Features:
@@ -245,22 +617,8 @@ Hyperparameters:
 
 def f_gen_child_mutate(candidate, features_name, p_mutate, hyperP, output_type, hyperparams_increment):
     if output_type == 'feature':        
-        # Create an integer list of features
-        l_features = list(range(0,len(features_name)))
-        
-        # Convert feature into boolean vector
-        candidate = [item in candidate for item in l_features]
-        
-        # Conditionally mutate features in chromosome (reverse binary flag)          
-        candidate_new = []
-        for item in candidate:
-            if rnd.rand() <= p_mutate:
-                candidate_new.append(not item)
-            else:
-                candidate_new.append(item)
-                
-        # Convert to indicies
-        candidate_new = [i for i,x in enumerate(candidate_new) if x == True]     
+        # Conditionally mutate features in genome (reverse binary flag)          
+        candidate_new = candidate ^ (rnd.rand(len(features_name)) <= p_mutate)
         return candidate_new
     
     elif (output_type == 'hyperparams') & (hyperP != False):
@@ -279,12 +637,12 @@ def f_gen_child_mutate(candidate, features_name, p_mutate, hyperP, output_type,
         candidate_new = []       
         for i in range(n_hyperP):
             if rnd.rand() <= p_mutate:   
-                temp = candidate['value'][i] * v_mutate
+                temp = candidate[i] * v_mutate
                 if hyperP['type'][i] == 'int':
                     temp = np.int64(round(temp))                
                 candidate_new.append(temp)
             else:
-                candidate_new.append(candidate['value'][i])
+                candidate_new.append(candidate[i])
         
         # Ensure that value is between ranges
         for i in range(n_hyperP):
@@ -294,12 +652,166 @@ def f_gen_child_mutate(candidate, features_name, p_mutate, hyperP, output_type,
                 candidate_new[i] = l_max[i]
 
         # Update values                
-        candidate['value'] = candidate_new
-        return candidate
+        return np.array(candidate_new, dtype=np.float64)
+
+"""Mutation can also be applied to a whole generation at once. The genomes of the population are stacked into a (population, features) matrix and the hyperparameters into a (population, hyperparameters) matrix, then:
+
+1. One random matrix with a row per candidate is drawn for the features and XOR'd into the genomes, the hyperparameter variants of a candidate keep sharing its (mutated) genome so they can still be evaluated as one batch
+2. One mutation size is drawn per candidate and applied to the hyperparameters selected by a second random matrix
+3. Integer hyperparameters are rounded and all values are clipped to the min-max range
+"""
+
+# Stack candidate hyperparameters into a matrix
+def f_hyperparams_to_array(l_hyperparams, hyperP):
+    '''(candidates, hyperparameters) matrix of values'''
+    if len(l_hyperparams) == 0:
+        return np.empty((0, len(hyperP['names'])))
+    return np.array([candidate['value'] for candidate in l_hyperparams], dtype=np.float64)
+
+# Convert a matrix of hyperparameter values to candidate dictionaries
+def f_hyperparams_from_array(values, hyperP):
+    '''List of {'name':[...], 'value':[...]} dictionaries'''
+    is_int = [t == 'int' for t in hyperP['type']]
+    return [{'name':list(hyperP['names']),
+             'value':[np.int64(round(v)) if is_int[j] else v for j, v in enumerate(row)]}
+            for row in values.tolist()]
+
+# Mutate a whole generation
+def f_mutate_population(genomes, values, p_mutate, hyperP, hyperparams_increment, streams=False, candidate=False):
+    '''Mutate the genome and hyperparameter matrices of a population (row i drawn from streams[candidate[i]], rows of a candidate share its genome)'''
+    if candidate is False:
+        candidate = np.arange(len(genomes))
+    
+    # Features - flip flags where the random number is below the mutation rate (once per candidate, then copied to its variants)
+    candidates, first, inverse = np.unique(candidate, return_index=True, return_inverse=True)
+    genomes = (genomes[first] ^ (f_random_rows(streams, candidates, genomes.shape[1:]) <= p_mutate))[inverse]
+    
+    # Hyperparameters
+    if hyperP != False:
+        
+        # Identify size of mutation for each candidate
+        if streams == False:
+            v_mutate = np.random.uniform((1-hyperparams_increment), (1+hyperparams_increment), (len(values), 1))
+        else:
+            v_mutate = (1-hyperparams_increment) + 2 * hyperparams_increment * f_random_rows(streams, candidate, (1,))
+        
+        # Probabilistically mutate certain parameters
+        mutate = f_random_rows(streams, candidate, values.shape[1:]) <= p_mutate
+        values = np.where(mutate, values * v_mutate, values)
+        
+        # Round integer parameters which have been mutated
+        is_int = np.array([t == 'int' for t in hyperP['type']], dtype=bool)
+        values = np.where(mutate & is_int, np.round(values), values)
+        
+        # Ensure that value is between ranges
+        values = np.clip(values, hyperP['min_value'], hyperP['max_value'])
+    
+    return genomes, values
+
+"""**POPULATION STORE**
+
+A population is held as a dictionary of NumPy arrays with one row per candidate solution (hyperparameter variant):
+
+* generation & candidate - integer identifiers
+* genomes - (rows, features) boolean matrix
+* values - (rows, hyperparameters) matrix of hyperparameter values
+* feature_size, evaluation_score, fitness_score, similarity_features, similarity_hyperparameters & probability - added as the population is evaluated
+
+The search history uses the same layout in arrays which are preallocated for the whole run (and doubled if they ever run out), so adding a generation is a copy of that generation only. A dataframe in the original output format is only built on request.
+"""
+
+# Create a population from its arrays
+def f_population_create(generation, candidate, genomes, values):
+    '''Population dictionary of arrays'''
+    return {'generation':np.full(len(genomes), generation, dtype=np.int64),
+            'candidate':np.asarray(candidate, dtype=np.int64),
+            'genomes':np.asarray(genomes, dtype=bool),
+            'values':np.asarray(values, dtype=np.float64)}
+
+# Select rows of a population
+def f_population_take(pop, idx):
+    '''Population containing the selected rows'''
+    return {field:pop[field][idx] for field in pop}
+
+# Stack populations
+def f_population_concat(l_pops):
+    '''Population containing the rows of every population (fields of the first)'''
+    return {field:np.concatenate([pop[field] for pop in l_pops]) for field in l_pops[0]}
+
+# Keep the best hyperparameter variant of each candidate
+def f_population_best_variant(pop):
+    '''One row per candidate, the variant with the highest fitness score'''
+    
+    # Sort by candidate then by descending fitness (stable, so the first of tied rows is kept)
+    # With a fidelity schedule, variants scored at a higher rung come first
+    if 'rung' in pop:
+        order = np.lexsort((-pop['fitness_score'], -pop['rung'], pop['candidate']))
+    else:
+        order = np.lexsort((-pop['fitness_score'], pop['candidate']))
+    candidate = pop['candidate'][order]
+    first = np.concatenate([[True], candidate[1:] != candidate[:-1]])
+    return f_population_take(pop, order[first])
+
+# Build a dataframe of a population
+def f_population_to_frame(pop, hyperP):
+    '''Dataframe with feature positions & hyperparameter dictionaries'''
+    df = pd.DataFrame({'generation':pop['generation'],
+                       'candidate':pop['candidate'],
+                       'features':[f_genome_to_idx(genome) for genome in pop['genomes']]})
+    if hyperP != False:
+        df['hyperparameters'] = f_hyperparams_from_array(pop['values'], hyperP)
+    for field in pop:
+        if field not in ['generation', 'candidate', 'genomes', 'values']:
+            df[field] = pop[field]
+    return df
+
+# Create the search history
+def f_history_create(pop, capacity):
+    '''Preallocated history with the fields of a population'''
+    history = {'size':0, 'fields':{}}
+    for field in pop:
+        history['fields'][field] = np.empty((capacity,) + pop[field].shape[1:], dtype=pop[field].dtype)
+    return history
+
+# Add a population to the search history
+def f_history_append(history, pop):
+    '''Copy a generation into the history arrays'''
+    field_first = next(iter(history['fields']))
+    n_rows = len(pop[field_first])
+    start = history['size']
+    capacity = len(history['fields'][field_first])
+    
+    # Grow storage if the preallocated capacity is exhausted
+    if start + n_rows > capacity:
+        capacity = max(2 * capacity, start + n_rows)
+        for field in history['fields']:
+            grown = np.empty((capacity,) + history['fields'][field].shape[1:], dtype=history['fields'][field].dtype)
+            grown[:start] = history['fields'][field][:start]
+            history['fields'][field] = grown
+    
+    for field in history['fields']:
+        history['fields'][field][start:start + n_rows] = pop[field]
+    history['size'] = start + n_rows
+
+# View of the stored rows of the history
+def f_history_view(history):
+    '''Population dictionary of the rows stored so far'''
+    return {field:arr[:history['size']] for field, arr in history['fields'].items()}
+
+# Build the output dataframe of the search
+def f_history_to_frame(history, hyperP):
+    '''Dataframe of every candidate assessed by the search'''
+    return f_population_to_frame(f_history_view(history), hyperP)
 
 # Function to generate a population of candidates
-def f_generate_population(inital_flag, population, features_name, p_crossover, p_mutate, hyperparams, hyperparams_increment, hyperparams_multiple, df=False, generation=0, initalise=False):
-    '''Generates all candidates in population'''
+def f_generate_population(inital_flag, population, features_name, p_crossover, p_mutate, hyperparams, hyperparams_increment, hyperparams_multiple, df=False, generation=0, initalise=False, rng=False, crossover_multiple=1):
+    '''Generates all candidates in population (crossover_multiple times as many crossover candidates, e.g. for screening)'''
+    
+    # Streams of the generation & its candidates
+    if rng != False:
+        streams = rng['candidate']
+    else:
+        streams = False
     # Create initial population
     if inital_flag == True:   
         # Check if there is an initial solution & reduce, population by one if there is
@@ -307,189 +819,858 @@ def f_generate_population(inital_flag, population, features_name, p_crossover, p
             population = population - 1
         
         # generate random features
-        df_pop = pd.DataFrame({'generation':generation,
-                               'candidate':range(0,population),
-                               'features': random_candidate(features_name,
-                                                              population,
-                                                              hyperparams,
-                                                              output_type = 'feature')})
+        genomes = f_random_candidates(features_name,
+                                      population,
+                                      hyperparams,
+                                      output_type = 'feature',
+                                      streams=streams)
         
         # Duplicate rows for population range
-        df_pop = df_pop.loc[df_pop.index.repeat(hyperparams_multiple)]
+        genomes = np.repeat(genomes, hyperparams_multiple, axis=0)
+        candidate = np.repeat(np.arange(population), hyperparams_multiple)
         
         # Generate population
-        df_pop['hyperparameters'] = random_candidate(features_name=features_name,
-                                population = population * hyperparams_multiple,
-                                hyperparams=hyperparams,
-                                output_type = 'hyperparams',
-                                df_pop=df_pop)
+        values = f_random_candidates(features_name=features_name,
+                                     population = population * hyperparams_multiple,
+                                     hyperparams=hyperparams,
+                                     output_type = 'hyperparams',
+                                     genomes=genomes,
+                                     streams=streams,
+                                     rows=candidate)
+        pop = f_population_create(generation, candidate, genomes, values)
     
         # If Initial solution then add in
         if initalise != False:
-            df = pd.DataFrame({'generation':generation,
-                               'candidate':range(population, population + 1),
-                               'features':[initalise['features']],
-                               'hyperparameters':[initalise['hyperparameters']]},
-                              index=[population])
-            
-            df_pop = df_pop.append(df)
-        
-        
-        # Reset Index
-        df_pop.index = range(0, population * hyperparams_multiple)
+            if hyperparams != False:
+                values = f_hyperparams_to_array([initalise['hyperparameters']], hyperparams)
+            else:
+                values = np.empty((1, 0))
+            pop_init = f_population_create(generation, [population],
+                                           f_genome_from_idx(initalise['features'], len(features_name))[None, :],
+                                           values)
+            pop = f_population_concat([pop, pop_init])
         
         # Return
-        return df_pop
+        return pop
     else:
         # Distribute the population
         population_crossover = round(population * p_crossover)
         population_remainder = population-population_crossover
+        population_crossover = population_crossover * crossover_multiple
         
         # ----- Create crossover candidates -----
         
-        # Create crossover populate for feature selection
-        df_pop = pd.DataFrame({'generation':generation,
-                               'candidate':range(0,population_crossover)})
-        df_pop['features'] = [f_gen_child_crossover(df=df, features_name=features_name, hyperparams=hyperparams, output_type = 'feature') \
-                              for _ in range(population_crossover)]
-            
+        # Crossover the whole generation
+        child_genomes, child_values = f_crossover_population(df['genomes'], df['values'], df['probability'],
+                                                             n_children=population_crossover,
+                                                             n_children_hyperP=population_crossover * hyperparams_multiple,
+                                                             hyperP=hyperparams,
+                                                             streams=streams)
+        
         # Duplicate rows for population range
-        df_pop = df_pop.loc[df_pop.index.repeat(hyperparams_multiple)]
-            
-        # Create crossover population for hyperparameters
-        df_pop['hyperparameters'] = [f_gen_child_crossover(df=df, features_name=features_name, hyperparams=hyperparams, output_type = 'hyperparams') \
-             for _ in range(population_crossover * hyperparams_multiple)]
-           
-        # Reset Index
-        df_pop.index = range(0, population_crossover * hyperparams_multiple)        
+        genomes = [np.repeat(child_genomes, hyperparams_multiple, axis=0)]
+        values = [child_values]
+        candidate = [np.repeat(np.arange(population_crossover), hyperparams_multiple)]
+        del child_genomes, child_values
                 
         # ----- Create Randomly Selected candidates ----- 
-        # Initialise population
-        df_temp = pd.DataFrame({'generation':generation,
-                                'candidate':range(population_crossover, 
-                                                  population)})   
         # Randomly select candidates
-        selected_index = \
-            df.sample(n=population_remainder,
-                      replace = False, 
-                      weights=df.probability).candidate.tolist()        
-        
-        # Extract hyperparameters
-        selected_features = df.iloc[selected_index,:].features.tolist()
-        selected_params = df.iloc[selected_index,:].hyperparameters.tolist()
-        
-        # Update temp dataframe
-        df_temp['features'] = [selected_features[i] 
-                               for i in range(len(selected_features))]
-        df_temp['hyperparameters'] = [selected_params[i] 
-                               for i in range(len(selected_params))]        
+        if rng != False:
+            selected_index = f_sample_parents(df['probability'], 1, population_remainder, streams=[rng['generation']])[0]
+        else:
+            selected_index = f_sample_parents(df['probability'], 1, population_remainder)[0]
         
         # Duplicate rows for population range
-        df_temp = df_temp.loc[df_temp.index.repeat(population_remainder)]
-        
-        # Append to population dataframe
-        df_pop = df_pop.append(df_temp,ignore_index=True)
+        selected_index = np.repeat(selected_index, population_remainder)
+        genomes.append(df['genomes'][selected_index])
+        values.append(df['values'][selected_index])
+        candidate.append(np.repeat(np.arange(population_crossover, population_crossover + population_remainder), population_remainder))
         
-        # Clear up
-        del selected_features, selected_params, df_temp
+        # Stack the population into genome and hyperparameter matrices
+        genomes = np.concatenate(genomes)
+        values = np.concatenate(values)
+        candidate = np.concatenate(candidate)
         
         # ----- Mutate Population -----
         
-        # Mutate existing candidate features
-        df_pop['features'] = \
-            df_pop.features.apply(f_gen_child_mutate, 
-                                  features_name=features_name,
-                                  p_mutate=p_mutate,
-                                  hyperparams=hyperparams,
-                                  output_type = 'feature',
-                                  hyperparams_increment=hyperparams_increment)
-        
-        # Mutate existing candidate hyperparameters
-        df_pop['hyperparameters'] = \
-            df_pop.hyperparameters.apply(f_gen_child_mutate, features_name=features_name,
-                                         p_mutate=p_mutate, hyperparams=hyperparams,
-                                         output_type = 'hyperparams', hyperparams_increment= hyperparams_increment)      
+        # Mutate the whole generation
+        genomes, values = f_mutate_population(genomes, values, p_mutate=p_mutate, hyperP=hyperparams,
+                                              hyperparams_increment=hyperparams_increment,
+                                              streams=streams, candidate=candidate)
         
         # ----- Hyperparameter fix -----
         if hyperparams != False:
-        
-            # Get length of features
-            n_features = df_pop['features'].apply(len).tolist()
             
-            # Hyperparameter fix            
-            for i in range(population):
-                for j in range(len(hyperparams['names'])):
-                    if hyperparams['names'][j] == 'max_features':
-                        if df_pop.hyperparameters[i]['value'][j] > n_features[i] :
-                            df_pop.hyperparameters[i]['value'][j] = \
-                                n_features[i]
+            # Limit max_features to the size of the genome
+            for j in range(len(hyperparams['names'])):
+                if hyperparams['names'][j] == 'max_features':
+                    values[:, j] = np.minimum(values[:, j], f_genome_size(genomes))
 
         # Return
-        return df_pop
+        return f_population_create(generation, candidate, genomes, values)
 
 """Evaluation of the solutions (models) created in each generation. This includes conducting cross validation and calculating the average AUC across folds."""
 
-#@ignore_warnings(category=ConvergenceWarning)
-def f_fitness(model, eval_metric, features, target, 
-              feature_idx, kfold, hyperparams):
-    '''Evaluates fitness of proposed solution'''
+"""**RACING**
+
+Optionally the folds of a candidate are evaluated one at a time (racing). Once at least min_folds folds have been scored, the candidate is aborted if the running mean plus z standard errors is below the threshold - the score it would need to be competitive in the generation, e.g. a quantile of the previous generation's evaluation scores or the score of the last elite. Aborted candidates keep the mean of the folds which were run as a partial score and are flagged in the output.
+
+race = {'quantile':0.25, 'z':1.0, 'min_folds':2} or {'elite':3, 'z':1.0, 'min_folds':2}
+"""
+
+# Failed fit of a fold
+def f_fit_failed(error):
+    '''Warn that a fold could not be fitted (as cross_val_score does), the fold scores NaN'''
+    warnings.warn('Fitting a fold failed, its score is set to NaN:\n' + ''.join(traceback.format_exception_only(type(error), error)), FitFailedWarning)
+    return np.nan
+
+# Variant for which no fold could be fitted
+def f_fit_check(results):
+    '''Raise when every fold of a variant failed to fit rather than scoring a misconfigured model 0 (as cross_val_score does)'''
+    if np.isnan(results).all():
+        raise ValueError(f'All the {len(results)} fits failed, the model is likely misconfigured (see the FitFailedWarning above for the errors)')
+
+# Score of a single fold
+def f_fold_score(model, scorer, X_train, y_train, X_test, y_test):
+    '''Fit on the training rows and score on the test rows (NaN with a warning if the fit fails)'''
+    try:
+        model.fit(X_train, y_train)
+    except Exception as error:
+        return f_fit_failed(error)
+    return scorer(model, X_test, y_test)
+
+# Score of a single fold fitted on the fold's Gram matrix
+def f_fold_score_gram(model, scorer, fold, cols, gram, Xy, coef_init=None):
+    '''Fit ElasticNet (or Lasso) on the sub-Gram of the columns and score on the test rows (NaN with a warning if the fit fails), with the fitted coefficients'''
+    params = model.get_params()
+    try:
+        _, coefs, dual_gaps, n_iters = enet_path(np.broadcast_to(np.float64(0), (len(fold['y_gram']), len(cols))), fold['y_gram'],
+                                                 l1_ratio=params.get('l1_ratio', 1.0), alphas=[params['alpha']], precompute=gram, Xy=Xy,
+                                                 coef_init=coef_init, max_iter=params['max_iter'], tol=params['tol'], 
+                                                 positive=params['positive'], selection=params['selection'], 
+                                                 random_state=params['random_state'], check_input=False, return_n_iter=True)
+    except Exception as error:
+        return f_fit_failed(error), None
+    
+    # Fitted model over every column (zero outside the candidate's columns) so the test rows are scored without a copy
+    model.coef_ = np.zeros(len(fold['X_mean']))
+    model.coef_[cols] = coefs[:, 0]
+    model.intercept_ = fold['y_mean'] - fold['X_mean'][cols] @ coefs[:, 0]
+    model.dual_gap_, model.n_iter_ = dual_gaps[0], n_iters[0]
+    model.n_features_in_ = len(fold['X_mean'])
+    with config_context(assume_finite=True):
+        return scorer(model, fold['X_test'], fold['y_test']), coefs[:, 0]
+
+# Racing decision after each fold
+def f_race_abort(results, race):
+    '''True once the upper confidence bound of the running mean is below the race threshold'''
+    n_folds = len(results)
+    if (race == False) or (race.get('threshold') is None) or (n_folds < race.get('min_folds', 2)):
+        return False
+    scores = np.nan_to_num(np.array(results))
+    v_bound = scores.mean() + race.get('z', 1.0) * scores.std(ddof=1) / np.sqrt(n_folds)
+    return v_bound < race['threshold']
+
+# Cross validation fold by fold
+def f_cv_scores(model, eval_metric, features, target, kfold, race=False, rows=False):
+    '''Fold scores, optionally training on a subset of rows and stopping once the candidate cannot reach the race threshold'''
+    
+    # Same splits as cross_val_score
+    cv = check_cv(kfold, target, classifier=is_classifier(model))
+    scorer = get_scorer(eval_metric)
+    target = np.asarray(target)
+    
+    results = []
+    for train, test in cv.split(features, target):
+        
+        # Restrict training rows to the fidelity subsample (test rows are kept whole)
+        if rows is not False:
+            train = train[rows[train]]
+        if isinstance(features, pd.DataFrame):
+            results.append(f_fold_score(model, scorer, features.iloc[train], target[train], features.iloc[test], target[test]))
+        else:
+            results.append(f_fold_score(model, scorer, features[train], target[train], features[test], target[test]))
         
-    # Extract the hyperparameters
-    n_hyperparams = len(hyperparams['name'])
-    hyperparameters = {hyperparams['name'][0]:hyperparams['value'][0]}
-    if n_hyperparams > 1:
-        for i in range(n_hyperparams):
-            tempparameters = {hyperparams['name'][i]:hyperparams['value'][i]}
-            hyperparameters = {**hyperparameters, **tempparameters}
+        # Upper confidence bound of the running mean
+        if f_race_abort(results, race):
+            break
+    
+    f_fit_check(results)
+    return np.array(results)
+
+# Threshold a candidate has to be able to reach in the next generation
+def f_race_threshold(df, race):
+    '''Elite score or quantile of the evaluation scores of a generation'''
+    evaluation_score = np.asarray(df['evaluation_score'], dtype=np.float64)
+    if race.get('elite', False) != False:
+        return np.sort(evaluation_score)[::-1][min(race['elite'], len(evaluation_score)) - 1]
+    return np.nanquantile(evaluation_score, race.get('quantile', 0.25))
+
+"""**MULTI-FIDELITY**
+
+Optionally the variants of a generation are scored with successive halving. Every variant is first cross validated cheaply, on a fraction of the training rows of each fold and/or with cheaper model settings (e.g. fewer XGBoost rounds), and only the top fraction is promoted to the next rung, up to the full evaluation. The test rows of each fold are always kept whole so the scores of all rungs are measured on the same rows. The row subsamples are stratified by the target and nested, each rung's rows contain the rows of the rung before. Variants which are not promoted keep the score of the last rung they reached, the rung is stored in the output.
+
+fidelity = {'fractions':[0.1, 0.3, 1.0], 'promote':0.33, 'params':[{'n_estimators':50}, {'n_estimators':100}, {}]}
+"""
+
+# Rungs of the fidelity schedule
+def f_fidelity_schedule(target, fidelity, rng=False):
+    '''Nested stratified row masks & model parameters of each rung'''
+    target = np.asarray(target)
+    n_rows = len(target)
+    
+    # Random position of each row within its class, so each subsample keeps the class balance
+    if rng != False:
+        order = rng.permutation(n_rows)
+    else:
+        order = rnd.permutation(n_rows)
+    rank = np.empty(n_rows, dtype=np.float64)
+    l_classes = np.unique(target)
+    if len(l_classes) <= 50:
+        for c in l_classes:
+            idx = order[target[order] == c]
+            rank[idx] = np.arange(len(idx)) / len(idx)
+    else:
+        rank[order] = np.arange(n_rows) / n_rows
+    
+    # Model parameters of each rung
+    l_params = fidelity.get('params', [{}] * len(fidelity['fractions']))
+    
+    schedule = []
+    for fraction, params in zip(fidelity['fractions'], l_params):
+        schedule.append({'fraction':fraction,
+                         'rows':(rank < fraction) if fraction < 1 else False,
+                         'params':params if len(params) > 0 else False})
+    return schedule
+
+"""**FOLD CACHE**
+
+Rather than splitting the data again for every candidate, the folds are built once per optimisation run. For each fold the train/test row indices, the target and the feature matrix of the train & test rows are stored as column-major NumPy arrays, so selecting a candidate's features is a cheap take of contiguous columns. For ElasticNet and Lasso the centred Gram matrix X^T X & X^T y of each fold's training rows are also computed once over every feature, a candidate is then fitted by coordinate descent on the sub-matrix of its features (enet_path with the precomputed Gram), so the cost of a fit depends on the number of features rather than the number of rows (only the test rows are touched, to score the fit). With bin_folds=True, for XGBoost histogram models (hist tree method, no missing values) each fold's features are instead binned once at the quantiles of its training rows into uint8 codes, with a small template matrix holding every bin of each column, and only the codes are kept: a candidate's QuantileDMatrix is built from the codes with the cuts of the template and a booster is trained on it (xgb.train), so XGBoost neither re-sketches the quantiles nor re-bins the float data for every fit. The cuts are exact quantiles of the fold rather than XGBoost's sketch, so scores differ slightly from a fit on the raw features (hence off by default), and hyperparameters which change the binning cannot be tuned. Every candidate of every generation is scored on the same folds. With kfold=False the folds are 5 stratified folds for a categorical target. The cache holds one copy of the training data per fold (its train + test rows), set fold_cache=False if that does not fit in memory.
+"""
+
+# Gram matrix of the training rows of a fold
+def f_fold_gram(X_train, y_train, fit_intercept=True, chunk=8192):
+    '''Centred X^T X & X^T y over every feature, with the means to recover the intercept'''
+    y_train = np.asarray(y_train, dtype=np.float64)
+    if fit_intercept:
+        X_mean, y_mean = X_train.mean(axis=0), y_train.mean()
+    else:
+        X_mean, y_mean = np.zeros(X_train.shape[1]), 0.0
+    y_gram = y_train - y_mean
+    
+    # Accumulate over blocks of rows so only one block is centred at a time
+    gram = np.zeros((X_train.shape[1], X_train.shape[1]))
+    Xy = np.zeros(X_train.shape[1])
+    for start in range(0, X_train.shape[0], chunk):
+        X_block = X_train[start:start + chunk] - X_mean
+        gram += X_block.T @ X_block
+        Xy += X_block.T @ y_gram[start:start + chunk]
+    return {'gram':gram, 'Xy':Xy, 'X_mean':X_mean, 'y_mean':y_mean, 'y_gram':y_gram}
+
+# Models which are fitted on the fold's Gram matrix
+def f_gram_check(model):
+    '''True for ElasticNet & Lasso (enet_path fits neither their subclasses, e.g. the multi-task models, nor other linear models)'''
+    return type(model) in [ElasticNet, Lasso]
+
+# Quantile bins of a fold
+def f_fold_bins(X_train, X_test, max_bin=256):
+    '''Bin codes of the train & test rows (cut at quantiles of the training rows) & a template with one row per bin of each column'''
+    dtype = np.uint8 if max_bin <= 256 else np.uint16
+    edges = np.quantile(X_train, np.linspace(0, 1, max_bin + 1)[1:-1], axis=0)
+    bins = {'B_train':np.empty(X_train.shape, dtype=dtype, order='F'),
+            'B_test':np.empty(X_test.shape, dtype=dtype, order='F')}
+    n_bins = np.zeros(X_train.shape[1], dtype=np.int64)
+    for j in range(X_train.shape[1]):
+        edges_j = np.unique(edges[:, j])
+        bins['B_train'][:, j] = np.searchsorted(edges_j, X_train[:, j], side='right')
+        bins['B_test'][:, j] = np.searchsorted(edges_j, X_test[:, j], side='right')
+        n_bins[j] = len(edges_j) + 1
+    
+    # Every bin code of each column once (the last code repeated), XGBoost takes its cuts from this instead of the data
+    bins['B_template'] = np.minimum(np.arange(max_bin)[:, None], n_bins[None, :] - 1).astype(dtype)
+    return bins
+
+# Score of a single fold fitted on the fold's bin codes
+def f_fold_score_binned(model, scorer, template, X_train, y_train, X_test, y_test):
+    '''Train a booster on the codes with the cuts of the template matrix (the data is only binned, not sketched) and score it through the model (NaN with a warning if the fit fails)'''
+    params = model.get_xgb_params()
+    n_classes = len(np.unique(y_train))
+    if is_classifier(model) and (n_classes > 2):
+        params = dict(params, objective='multi:softprob', num_class=n_classes)
+    try:
+        dtrain = QuantileDMatrix(X_train, y_train, ref=template, max_bin=template.num_row(), nthread=model.n_jobs)
+        booster = xgb.train(params, dtrain, num_boost_round=model.get_num_boosting_rounds())
+    except Exception as error:
+        return f_fit_failed(error)
+    model.load_model(bytearray(booster.save_raw()))
+    return scorer(model, X_test, y_test)
+
+# Models which are fitted on the binned fold
+def f_binned_check(model):
+    '''True for XGBoost histogram tree models'''
+    if not isinstance(model, XGBModel):
+        return False
+    params = model.get_params()
+    return (params['tree_method'] in [None, 'hist', 'auto']) and (params['booster'] in [None, 'gbtree', 'dart']) and (params['device'] in [None, 'cpu'])
+
+# Precompute the cross validation folds
+def f_fold_cache(features, target, kfold, model, splits=False, bin_folds=False):
+    '''Row indices, target & column-major feature arrays of each fold (splits can be given, e.g. from a checkpoint, bin_folds - bin codes in place of the features for XGBoost)'''
+    target = np.asarray(target)
+    
+    # Stratified folds for a categorical target
+    if kfold == False:
+        if type_of_target(target) in ['binary', 'multiclass']:
+            kfold = StratifiedKFold(n_splits=5)
+        else:
+            kfold = 5
+    cv = check_cv(kfold, target, classifier=is_classifier(model))
+    
+    # Split once
+    arr = np.asarray(features, dtype=np.float64)
+    if splits == False:
+        splits = cv.split(arr, target)
+    folds = []
+    for train, test in splits:
+        folds.append({'train':train,
+                      'test':test,
+                      'X_train':np.asfortranarray(arr[train]),
+                      'X_test':np.asfortranarray(arr[test]),
+                      'y_train':target[train],
+                      'y_test':target[test]})
+        
+        # Gram matrix for ElasticNet & Lasso (when it is no larger than the fold's training rows)
+        if f_gram_check(model) and (arr.shape[1] <= len(train)):
+            folds[-1].update(f_fold_gram(folds[-1]['X_train'], folds[-1]['y_train'], model.get_params()['fit_intercept']))
+        
+        # Bin codes for XGBoost replace the features (missing values are left to XGBoost)
+        if (bin_folds != False) and f_binned_check(model) and np.isfinite(arr).all():
+            folds[-1].update(f_fold_bins(folds[-1]['X_train'], folds[-1]['X_test'], model.get_params()['max_bin'] or 256))
+            del folds[-1]['X_train'], folds[-1]['X_test']
+    del arr
+    return folds
+
+# Regularisation path of a model
+def f_warm_start_path(model):
+    '''Parameter ordering the variants (strongest regularisation first) when fits can be warm started from each other, otherwise False'''
+    if f_gram_check(model):
+        return 'alpha'
+    return False
+
+# Evaluate the hyperparameter variants of one feature set
+def f_fitness_batch(model, eval_metric, features, target, 
+                    feature_idx, kfold, l_hyperparams, race=False, rows=False, params=False, folds=False):
+    '''Fold scores & seconds spent cross validating each variant, slicing the candidate's features once for the batch'''
+    
+    # Model parameters of each variant (with the parameters fixed by the fidelity rung, e.g. fewer boosting rounds)
+    l_params = []
+    for hyperparams in l_hyperparams:
+        if hyperparams != False:
+            hyperparameters = dict(zip(hyperparams['name'], hyperparams['value']))
+        else:
+            hyperparameters = {}
+        if params != False:
+            hyperparameters = {**hyperparameters, **params}
+        l_params.append(hyperparameters)
     
     # Determine CV strategy
     if kfold == False:
         kfold = 5
-    else:
-        kfold = kfold
     
-    # Apply cross validation to the modells
-    results = cross_val_score(model.set_params(**hyperparameters), 
-                              features.iloc[:,feature_idx], 
-                              target,
-                              cv=kfold,
-                              scoring=eval_metric)
+    l_output = [None] * len(l_params)
+    
+    # Cross validate on the fold cache
+    if folds != False:
+        scorer = get_scorer(eval_metric)
+        cols = np.flatnonzero(feature_idx) if np.asarray(feature_idx).dtype == bool else np.asarray(feature_idx)
+        
+        # ElasticNet & Lasso fit on the sub-Gram of the fold, sliced once for every variant (unless the training rows are subsampled)
+        gram = ('gram' in folds[0]) and (rows is False) and (f_warm_start_path(model) != False)
+        
+        # XGBoost fits on the bin codes of the fold, with the cuts of the fold's template
+        binned = ('B_train' in folds[0])
+        if binned:
+            for hyperparameters in l_params:
+                variant = clone(model).set_params(**hyperparameters)
+                if (not f_binned_check(variant)) or ((variant.get_params()['max_bin'] or 256) != len(folds[0]['B_template'])):
+                    raise ValueError('Hyperparameters which change the binning (max_bin, tree_method, booster, device) cannot be tuned with bin_folds')
+            l_fold_templates = [QuantileDMatrix(np.ascontiguousarray(fold['B_template'][:, cols]), max_bin=len(fold['B_template'])) for fold in folds]
+        
+        # Candidate columns of each fold, sliced once for every variant
+        l_fold_data = []
+        for fold in folds:
+            if gram:
+                l_fold_data.append((np.ascontiguousarray(fold['gram'][np.ix_(cols, cols)]), fold['Xy'][cols]))
+            elif binned and (rows is not False):
+                keep = np.flatnonzero(rows[fold['train']])
+                l_fold_data.append((fold['B_train'][np.ix_(keep, cols)], fold['y_train'][keep], 
+                                    np.take(fold['B_test'], cols, axis=1), fold['y_test']))
+            elif binned:
+                l_fold_data.append((np.take(fold['B_train'], cols, axis=1), fold['y_train'], 
+                                    np.take(fold['B_test'], cols, axis=1), fold['y_test']))
+            elif rows is not False:
+                keep = np.flatnonzero(rows[fold['train']])
+                l_fold_data.append((fold['X_train'][np.ix_(keep, cols)], fold['y_train'][keep], 
+                                    np.take(fold['X_test'], cols, axis=1), fold['y_test']))
+            else:
+                l_fold_data.append((np.take(fold['X_train'], cols, axis=1), fold['y_train'], 
+                                    np.take(fold['X_test'], cols, axis=1), fold['y_test']))
+        
+        # Along the regularisation path each fold's model is refitted from the previous variant's solution
+        path = f_warm_start_path(model)
+        if path != False:
+            order = sorted(range(len(l_params)), key=lambda i: (sorted((name, value) for name, value in l_params[i].items() if name != path), 
+                                                                -l_params[i].get(path, model.get_params()[path])))
+            l_fold_models = [clone(model).set_params(warm_start=True) for fold in folds]
+            l_fold_coef = [None] * len(folds)
+        else:
+            order = range(len(l_params))
+        
+        for i in order:
+            time_start = time.perf_counter()
+            results = []
+            for j, fold_data in enumerate(l_fold_data):
+                if gram:
+                    score, l_fold_coef[j] = f_fold_score_gram(l_fold_models[j].set_params(**l_params[i]), scorer, folds[j], cols, 
+                                                              *fold_data, coef_init=l_fold_coef[j])
+                    results.append(score)
+                else:
+                    if path != False:
+                        fold_model = l_fold_models[j].set_params(**l_params[i])
+                    else:
+                        fold_model = clone(model).set_params(**l_params[i])
+                    if binned:
+                        results.append(f_fold_score_binned(fold_model, scorer, l_fold_templates[j], *fold_data))
+                    else:
+                        results.append(f_fold_score(fold_model, scorer, *fold_data))
+                
+                # Upper confidence bound of the running mean
+                if f_race_abort(results, race):
+                    break
+            f_fit_check(results)
+            l_output[i] = (np.array(results), time.perf_counter() - time_start)
+    
+    else:
+        # Extract the candidate features once (dataframe or shared numpy matrix)
+        if isinstance(features, pd.DataFrame):
+            features = features.iloc[:,feature_idx]
+        else:
+            features = features[:,feature_idx]
+        
+        # Apply cross validation to the modells
+        for i, hyperparameters in enumerate(l_params):
+            time_start = time.perf_counter()
+            if ((race != False) and (race.get('threshold') is not None)) or (rows is not False):
+                results = f_cv_scores(clone(model).set_params(**hyperparameters),
+                                      eval_metric,
+                                      features,
+                                      target,
+                                      kfold,
+                                      race=race,
+                                      rows=rows)
+            else:
+                results = cross_val_score(clone(model).set_params(**hyperparameters), 
+                                          features, 
+                                          target,
+                                          cv=kfold,
+                                          scoring=eval_metric)
+            l_output[i] = (results, time.perf_counter() - time_start)
     
     # Replace NA's with 0
-    results[np.isnan(results)] = 0
+    for results, _ in l_output:
+        results[np.isnan(results)] = 0
     
+    return l_output
+
+#@ignore_warnings(category=ConvergenceWarning)
+def f_fitness(model, eval_metric, features, target, 
+              feature_idx, kfold, hyperparams, race=False, rows=False, params=False, folds=False):
+    '''Evaluates fitness of proposed solution'''
+    results, _ = f_fitness_batch(model, eval_metric, features, target, feature_idx, kfold, [hyperparams], 
+                                 race=race, rows=rows, params=params, folds=folds)[0]
     return results
 
-"""The evaulation for each fold is then averaged to have a final score for that candidate solution (model)."""
+# Summarise the fold results of a candidate
+def f_candidate_result(results, fit_time=0.0):
+    '''Mean evaluation score, number of folds run and seconds spent cross validating'''
+    return {'evaluation_score':results.mean(), 'n_folds':len(results), 'fit_time':fit_time}
 
-# Apply evaluation score to current population
-def f_evaluation_score(df, features, target, eval_metric, model,
-                       kfold, hyperparams):
-    '''Apply f_fitness to each candidate'''
+"""**EVALUATION CACHE**
+
+Unchanged survivors, elite candidates and children which mutation left untouched are identical to solutions which have already been scored. Rather than re-running cross validation for them the mean score is stored against a canonical key:
+
+1. Sorted feature set
+2. Hyperparameter names and values
+3. Model (class and the parameters which are not being tuned)
+4. Evaluation metric and folds
+
+The cache is bounded in size, the least recently used entry is evicted first and hits/misses are counted so the saving can be reported.
+"""
+
+# Create an empty evaluation cache
+def f_cache_create(max_size=10000):
+    '''Bounded LRU store of candidate evaluation scores'''
+    return {'store':OrderedDict(), 'max_size':max_size, 'hits':0, 'misses':0}
+
+# Canonical key of a candidate evaluation
+def f_cache_key(model, eval_metric, kfold, genome, hyperparams, rung=False):
+    '''Key identifying a candidate evaluation regardless of feature order'''
+    
+    # Feature set as packed bits
+    key_features = f_genome_pack(genome).tobytes()
+    
+    # Hyperparameters of the candidate
+    if hyperparams != False:
+        key_hyperparams = tuple(zip(hyperparams['name'], [float(v) for v in hyperparams['value']]))
+        l_tuned = hyperparams['name']
+    else:
+        key_hyperparams = ()
+        l_tuned = []
+    
+    # Model parameters which are not being tuned
+    key_model = (type(model).__name__,
+                 tuple(sorted((k, repr(v)) for k, v in model.get_params().items() if k not in l_tuned)))
+    
+    # CV strategy
+    if kfold == False:
+        key_kfold = 5
+    else:
+        key_kfold = repr(kfold)
+    
+    # Fidelity of the evaluation (None for all rows & the model as given)
+    if (rung == False) or ((rung['rows'] is False) and (rung['params'] == False)):
+        key_fidelity = None
+    else:
+        key_fidelity = (rung['fraction'], repr(rung['params']))
+    
+    return (key_features, key_hyperparams, key_model, eval_metric, key_kfold, key_fidelity)
+
+# Look up a score, None if the candidate has not been evaluated
+def f_cache_get(cache, key):
+    '''Retrieve a score and mark it as most recently used'''
+    if key in cache['store']:
+        cache['store'].move_to_end(key)
+        cache['hits'] += 1
+        return cache['store'][key]
+    cache['misses'] += 1
+    return None
+
+# Store a score, evicting the least recently used entries
+def f_cache_put(cache, key, value):
+    '''Add a score to the cache'''
+    cache['store'][key] = value
+    cache['store'].move_to_end(key)
+    while len(cache['store']) > cache['max_size']:
+        cache['store'].popitem(last=False)
+
+# Summary of cache usage
+def f_cache_stats(cache):
+    '''Hits, misses, size and hit rate of the cache'''
+    n_lookups = cache['hits'] + cache['misses']
+    return {'hits':cache['hits'],
+            'misses':cache['misses'],
+            'size':len(cache['store']),
+            'hit_rate':cache['hits'] / n_lookups if n_lookups > 0 else 0.0}
+
+"""**PARALLEL EVALUATION**
+
+Candidates within a generation are independent so they can be scored in a pool of worker processes. The feature matrix (or the arrays of the fold cache) is copied into shared memory once when the pool is started, each worker attaches to it when it starts and tasks only carry the candidate's feature positions and hyperparameters. The fold arrays of the parent process are swapped for views of the shared copies, so the fold cache is held once rather than twice. The pool lives for the whole optimisation run and is shut down (and the shared memory, with the fold arrays, released) at the end.
+"""
+
+# State of a worker process, set once by f_worker_init
+worker_state = {}
+
+# Copy an array into shared memory
+def f_shm_publish(arr):
+    '''Shared memory block holding a column-major copy of the array & its spec'''
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    shared = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf, order='F')
+    shared[:] = arr
+    return shm, (shm.name, arr.shape, arr.dtype.str)
+
+# Attach to an array in shared memory
+def f_shm_attach(spec):
+    '''Shared memory block & the array view of a spec from f_shm_publish'''
+    shm_name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=shm_name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf, order='F')
+
+# Initialise a worker process
+def f_worker_init(features_spec, folds_spec, target, model, eval_metric, kfold, schedule=False):
+    '''Attach the worker to the shared feature matrix / fold arrays'''
+    worker_state['shm'] = []
+    
+    # Feature matrix
+    if features_spec is not None:
+        shm, worker_state['features'] = f_shm_attach(features_spec)
+        worker_state['shm'].append(shm)
+    else:
+        worker_state['features'] = None
+    
+    # Fold cache
+    if folds_spec != False:
+        folds = []
+        for fold_spec in folds_spec:
+            fold = dict(fold_spec)
+            for field in [field for field in ['X_train', 'X_test', 'B_train', 'B_test'] if field in fold_spec]:
+                shm, fold[field] = f_shm_attach(fold_spec[field])
+                worker_state['shm'].append(shm)
+            folds.append(fold)
+        worker_state['folds'] = folds
+    else:
+        worker_state['folds'] = False
+    
+    worker_state['target'] = target
+    worker_state['model'] = model
+    worker_state['eval_metric'] = eval_metric
+    worker_state['kfold'] = kfold
+    worker_state['schedule'] = schedule
+
+# Evaluate the variants of a feature set inside a worker process
+def f_worker_fitness(task):
+    '''Mean cross validation score of each variant of a feature set'''
+    feature_idx, l_hyperparams, race, rung = task
+    
+    # Row subsample & model parameters of the fidelity rung
+    if rung is not False:
+        rows = worker_state['schedule'][rung]['rows']
+        params = worker_state['schedule'][rung]['params']
+    else:
+        rows = False
+        params = False
+    
+    l_output = f_fitness_batch(model=worker_state['model'],
+                               eval_metric=worker_state['eval_metric'],
+                               features=worker_state['features'],
+                               target=worker_state['target'],
+                               feature_idx=feature_idx,
+                               kfold=worker_state['kfold'],
+                               l_hyperparams=l_hyperparams,
+                               race=race,
+                               rows=rows,
+                               params=params,
+                               folds=worker_state['folds'])
+    return [f_candidate_result(eval_score, fit_time) for eval_score, fit_time in l_output]
+
+# Evaluate several feature sets inside a worker process
+def f_worker_fitness_tasks(tasks):
+    '''Results of every variant of the tasks, in task order'''
+    return [result for task in tasks for result in f_worker_fitness(task)]
+
+# Start the worker pool
+def f_pool_start(features, target, model, eval_metric, kfold, n_workers, schedule=False, folds=False):
+    '''Publish the feature matrix (or the fold cache) in shared memory and start the workers'''
+    l_shm = []
+    
+    # Fold arrays are already column-major, only the row indices & targets are passed to the workers
+    # The parent works on the shared copy of each fold array from then on, so its own copy is released
+    if folds != False:
+        features_spec = None
+        folds_spec = []
+        for fold in folds:
+            fold_spec = {field:fold[field] for field in fold if field not in ['X_train', 'X_test', 'B_train', 'B_test']}
+            for field in [field for field in ['X_train', 'X_test', 'B_train', 'B_test'] if field in fold]:
+                shm, fold_spec[field] = f_shm_publish(fold[field])
+                fold[field] = np.ndarray(fold[field].shape, dtype=fold[field].dtype, buffer=shm.buf, order='F')
+                l_shm.append(shm)
+            folds_spec.append(fold_spec)
+    else:
+        # Column-major copy so each candidate's column subset is contiguous
+        shm, features_spec = f_shm_publish(np.asfortranarray(features.to_numpy(dtype=np.float64)))
+        l_shm.append(shm)
+        folds_spec = False
+    
+    # Fork so the workers inherit the functions defined in this notebook
+    if 'fork' in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context('fork')
+    else:
+        mp_context = multiprocessing.get_context()
+    
+    executor = ProcessPoolExecutor(max_workers=n_workers,
+                                   mp_context=mp_context,
+                                   initializer=f_worker_init,
+                                   initargs=(features_spec, folds_spec, np.asarray(target), 
+                                             model, eval_metric, kfold, schedule))
+    
+    return {'executor':executor, 'shm':l_shm, 'n_workers':n_workers, 'folds':folds}
+
+# Stop the worker pool
+def f_pool_stop(pool):
+    '''Shut down the workers (tasks which have not started are cancelled) and release the shared memory (with the fold arrays held in it)'''
+    pool['executor'].shutdown(wait=True, cancel_futures=True)
+    if pool['folds'] != False:
+        for fold in pool['folds']:
+            for field in ['X_train', 'X_test', 'B_train', 'B_test']:
+                fold.pop(field, None)
+    for shm in pool['shm']:
+        shm.close()
+        shm.unlink()
+
+"""The evaulation for each fold is then averaged to have a final score for that candidate solution (model). When a cache is supplied, candidates which have been scored before are looked up instead of being cross validated again (only complete cross validations are stored). When a pool is supplied the remaining candidates are scored by the workers, results come back in the same order as the population. Alongside the score the number of folds run, whether the candidate was aborted by racing and the seconds spent cross validating it are returned. A rung of the fidelity schedule can be given to score the candidates on a subsample of the training rows / with cheaper model settings."""
+
+# Candidates of a population which have to be cross validated
+def f_evaluation_tasks(df, model, eval_metric, kfold, hyperparams, cache=False, race=False, schedule=False, rung=False):
+    '''Cached results & one task per feature set for the remaining candidates'''
+    
+    # Fidelity rung to evaluate at
+    if rung is not False:
+        d_rung = schedule[rung]
+    else:
+        d_rung = False
+    
+    # Hyperparameter dictionaries of the candidates
+    if hyperparams != False:
+        l_hyperparams = f_hyperparams_from_array(df['values'], hyperparams)
+    else:
+        l_hyperparams = [False] * len(df['genomes'])
+    
+    # Look up candidates which have already been evaluated
+    l_results = [None] * len(df['genomes'])
+    l_pending = []
+    d_pending = {}
+    for val in range(0, len(df['genomes'])):
+        if cache != False:
+            key = f_cache_key(model, eval_metric, kfold, df['genomes'][val], l_hyperparams[val], rung=d_rung)
+            
+            # Duplicate of a candidate already waiting in this population
+            if key in d_pending:
+                d_pending[key].append(val)
+                cache['hits'] += 1
+                continue
+            
+            cached_result = f_cache_get(cache, key)
+            if cached_result is not None:
+                l_results[val] = cached_result
+                continue
+            d_pending[key] = [val]
+        else:
+            key = None
+        l_pending.append((val, key))
+    
+    # Group the remaining candidates by feature set, the variants of a feature set are evaluated as one batch
+    d_batches = OrderedDict()
+    for val, key in l_pending:
+        d_batches.setdefault(df['genomes'][val].tobytes(), []).append((val, key))
+    l_pending = [(val, key) for batch in d_batches.values() for val, key in batch]
+    tasks = [(df['genomes'][batch[0][0]], [l_hyperparams[val] for val, _ in batch], race, rung) for batch in d_batches.values()]
     
-    # Calculate the evaluation metric
-    evaluation_score = []
-    for val in range(0, len(df)):
-        eval_score = f_fitness(model=model,
-                               eval_metric=eval_metric,
-                               features = features,
-                               target=target,
-                               feature_idx=df['features'][val],
-                               kfold=kfold,
-                               hyperparams=df['hyperparameters'][val])
+    return {'results':l_results, 'pending':l_pending, 'duplicates':d_pending, 'tasks':tasks}
+
+# Cross validate tasks in this process
+def f_evaluation_run(tasks, features, target, eval_metric, model, kfold, schedule=False, folds=False):
+    '''Result of every variant of the tasks, in task order'''
+    l_scores = []
+    for feature_idx, batch_hyperparams, batch_race, rung in tasks:
+        l_output = f_fitness_batch(model=model,
+                                   eval_metric=eval_metric,
+                                   features = features,
+                                   target=target,
+                                   feature_idx=feature_idx,
+                                   kfold=kfold,
+                                   l_hyperparams=batch_hyperparams,
+                                   race=batch_race,
+                                   rows=schedule[rung]['rows'] if rung is not False else False,
+                                   params=schedule[rung]['params'] if rung is not False else False,
+                                   folds=folds)
         
         # Average evaluation metric across folds
-        evaluation_score.append(eval_score.mean())
+        l_scores += [f_candidate_result(eval_score, fit_time) for eval_score, fit_time in l_output]
         
         # Clear object
-        del eval_score
+        del l_output
+    return l_scores
+
+# Scores of a population from the results of its tasks
+def f_evaluation_collect(evaluation, l_scores, target, model, kfold, cache=False, folds=False):
+    '''Stack the cached & new results into arrays, storing complete evaluations in the cache'''
+    
+    # Number of folds in a complete cross validation
+    if folds != False:
+        v_folds = len(folds)
+    elif kfold == False:
+        v_folds = check_cv(5, target, classifier=is_classifier(model)).get_n_splits()
+    else:
+        v_folds = kfold.get_n_splits()
+    
+    # Populate scores and store complete evaluations for repeated candidates
+    l_results = evaluation['results']
+    fit_time = np.zeros(len(l_results), dtype=np.float64)
+    for (val, key), result in zip(evaluation['pending'], l_scores):
+        l_results[val] = result
+        fit_time[val] = result['fit_time']
+        if cache != False:
+            for val_dup in evaluation['duplicates'][key]:
+                l_results[val_dup] = result
+            if result['n_folds'] == v_folds:
+                f_cache_put(cache, key, result)
+    
+    # Stack into arrays
+    evaluation_score = {'evaluation_score':np.array([result['evaluation_score'] for result in l_results], dtype=np.float64),
+                        'n_folds':np.array([result['n_folds'] for result in l_results], dtype=np.int64)}
+    evaluation_score['aborted'] = evaluation_score['n_folds'] < v_folds
+    
+    # Time spent cross validating each candidate (0 when the score came from the cache)
+    evaluation_score['fit_time'] = fit_time
+    
+    return evaluation_score
+
+# Apply evaluation score to current population
+def f_evaluation_score(df, features, target, eval_metric, model,
+                       kfold, hyperparams, cache=False, pool=False, race=False, schedule=False, rung=False, folds=False):
+    '''Apply f_fitness to each candidate'''
+    
+    # Cached results & the candidates which have to be cross validated
+    evaluation = f_evaluation_tasks(df, model, eval_metric, kfold, hyperparams, cache=cache, race=race, schedule=schedule, rung=rung)
+    
+    # Calculate the evaluation metric for the remaining candidates
+    tasks = evaluation['tasks']
+    if (pool != False) & (len(tasks) > 0):
+        chunksize = max(1, len(tasks) // (pool['n_workers'] * 4))
+        l_scores = [result for l_batch in pool['executor'].map(f_worker_fitness, tasks, chunksize=chunksize) for result in l_batch]
+    else:
+        l_scores = f_evaluation_run(tasks, features, target, eval_metric, model, kfold, schedule=schedule, folds=folds)
+    
+    # Stack into arrays
+    evaluation_score = f_evaluation_collect(evaluation, l_scores, target, model, kfold, cache=cache, folds=folds)
     
     # Clear object
-    del val
+    del tasks, evaluation, l_scores
     
     # return evaluation score
     return evaluation_score
 
+# Successive halving over the fidelity schedule
+def f_successive_halving(df, features, target, eval_metric, model,
+                         kfold, hyperparams, schedule, promote, cache=False, pool=False, race=False, folds=False):
+    '''Score every candidate at the first rung and promote the top fraction rung by rung'''
+    n_rows = len(df['genomes'])
+    evaluation_score = {'evaluation_score':np.zeros(n_rows, dtype=np.float64),
+                        'n_folds':np.zeros(n_rows, dtype=np.int64),
+                        'aborted':np.zeros(n_rows, dtype=bool),
+                        'rung':np.zeros(n_rows, dtype=np.int64),
+                        'fit_time':np.zeros(n_rows, dtype=np.float64)}
+    
+    active = np.arange(n_rows)
+    for rung in range(len(schedule)):
+        
+        # Racing only applies to the full evaluation
+        last_rung = rung == len(schedule) - 1
+        rung_score = f_evaluation_score(f_population_take(df, active), features, target, eval_metric, model, kfold, hyperparams,
+                                        cache=cache, pool=pool, race=race if last_rung else False,
+                                        schedule=schedule, rung=rung, folds=folds)
+        for field in ['evaluation_score', 'n_folds', 'aborted']:
+            evaluation_score[field][active] = rung_score[field]
+        evaluation_score['rung'][active] = rung
+        evaluation_score['fit_time'][active] += rung_score['fit_time']
+        
+        # Promote the best candidates of the rung (original order kept)
+        if not last_rung:
+            n_promote = max(1, int(np.ceil(promote * len(active))))
+            order = np.argsort(-rung_score['evaluation_score'], kind='stable')
+            active = active[np.sort(order[:n_promote])]
+    
+    return evaluation_score
+
 """Calculation of the similarity between each solution and the best solution based on the performance metric in a generation. Tracks how similar the generated solutions are becoming over time. 
 
 1. Jaccard similarity - the feature selection element of the algorithm  
@@ -498,31 +1679,66 @@ def f_evaluation_score(df, features, target, eval_metric, model,
 """
 
 # Jaccard similarity
-def f_j_sim(list1, list2):
-    s1 = set(list1)
-    s2 = set(list2)
-    return float(len(s1.intersection(s2)) / len(s1.union(s2)))
+def f_j_sim(genome1, genome2):
+    return float(f_genome_jaccard(genome1, genome2)[0])
 
 # Cosine similarity
 def f_c_sim(l_other, l_best_score): 
-    # Extract hyperparameter values
-    l_other = l_other['value']
     # calculate similarity        
     sim = 1 - spatial.distance.cosine(l_best_score, l_other)
     return sim
 
+"""For a whole population the similarities are calculated on the matrices rather than per candidate:
+
+* Jaccard - popcounts of the packed genome matrix AND / OR the best genome
+* Cosine - one matrix-vector product of the row normalised hyperparameter matrix with the best candidate's normalised values
+* Pairwise (optional, for diversity tracking) - intersections of every pair of genomes from one matrix product, and the Gram matrix of the normalised hyperparameters. One minus the mean similarity of each candidate to the rest of the population is stored as diversity_features & diversity_hyperparameters (higher is more diverse)
+"""
+
+# Row normalise a matrix of hyperparameter values
+def f_normalise_rows(values):
+    '''Rows scaled to unit length (zero rows left as zero)'''
+    norms = np.linalg.norm(values, axis=1)
+    return values / np.where(norms > 0, norms, 1)[:, None]
+
+# Pairwise similarity of all candidates
+def f_similarity_matrix(genomes, values):
+    '''(candidates, candidates) Jaccard and cosine similarity matrices'''
+    
+    # Jaccard - intersections from a matrix product, union from the set sizes
+    genomes_f = genomes.astype(np.float32)
+    v_intersection = genomes_f @ genomes_f.T
+    v_size = genomes_f.sum(axis=1)
+    v_union = v_size[:, None] + v_size[None, :] - v_intersection
+    sim_features = np.where(v_union > 0, v_intersection / np.maximum(v_union, 1), 1.0)
+    
+    # Cosine - Gram matrix of the normalised values
+    values_norm = f_normalise_rows(values)
+    sim_hyperparameters = values_norm @ values_norm.T
+    
+    return sim_features, sim_hyperparameters
+
 # Calculate similarity between candidates and probability for next gen selection
-def f_sim_n_prob(df):
+def f_sim_n_prob(df, pairwise=False):
+    
+    # Best candidate of the population
+    v_best = np.nanargmax(df['fitness_score'])
         
     # Calculate similarity of solutions with best solutions - Features
-    l_best_score = df.features[df['fitness_score'].idxmax()]
-    df['similarity_features'] = df['features'].apply(f_j_sim, list2=l_best_score)
-    del l_best_score
+    df['similarity_features'] = f_genome_jaccard(df['genomes'], df['genomes'][v_best])
 
     # Calculate similarity of solutions with best solutions
-    l_best_score = df.hyperparameters[df['fitness_score'].idxmax()]['value']
-    df['similarity_hyperparameters'] = df.hyperparameters.apply(f_c_sim, l_best_score=l_best_score)
-    del l_best_score 
+    values_norm = f_normalise_rows(df['values'])
+    df['similarity_hyperparameters'] = values_norm @ values_norm[v_best]
+    del values_norm
+    
+    # Diversity of each solution, one minus its mean similarity to the rest of the population
+    if pairwise == True:
+        n_pop = len(df['genomes'])
+        sim_features, sim_hyperparameters = f_similarity_matrix(df['genomes'], df['values'])
+        df['diversity_features'] = 1 - (sim_features.sum(axis=1) - np.diag(sim_features)) / max(n_pop - 1, 1)
+        df['diversity_hyperparameters'] = 1 - (sim_hyperparameters.sum(axis=1) - np.diag(sim_hyperparameters)) / max(n_pop - 1, 1)
+        del sim_features, sim_hyperparameters
         
     # Calculate cumulative probability for future stages
     df['probability'] = (df['fitness_score'] / sum(df['fitness_score']))
@@ -530,53 +1746,99 @@ def f_sim_n_prob(df):
     # return
     return df
 
+"""**DESIRABILITY**
+
+Desirability functions map each objective onto a 0-1 scale (a power curve between the bounds, 0 or 1 outside them):
+
+* maximise - 0 below the lower bound, 1 above the upper bound, ((x-lb)/(ub-lb))^s in between
+* minimise - 1 below the lower bound, 0 above the upper bound, ((x-ub)/(lb-ub))^s in between
+
+The overall desirability is the weighted geometric mean of the individual desirabilities. The settings are a dictionary of lists with one entry per objective, 'lb', 'ub' and 's' are required and by default the objectives are the evaluation metric (maximise) and the number of features (minimise):
+
+{'lb':[...], 'ub':[...], 's':[...], 'objective':['evaluation_score', 'feature_size'], 'goal':['max', 'min'], 'weight':[1, 1]}
+
+Any numeric column of a population (or of the output dataframe) can be an objective, so stored history can be re-scored under new settings without re-running the search, e.g. df_output['fitness_score'] = f_desirability(df_output, new_settings).
+"""
+
+# Desirability of an objective which should be maximised
+def f_desire_max(x, lb, ub, s):
+    '''0 below lb, 1 above ub, power curve in between'''
+    x = np.asarray(x, dtype=np.float64)
+    desire = np.clip((x - lb) / (ub - lb), 0, 1) ** s
+    
+    # Out of range values explicitly (with s=0 the power curve is 1 everywhere)
+    return np.where(x < lb, 0.0, np.where(x > ub, 1.0, desire))
+
+# Desirability of an objective which should be minimised
+def f_desire_min(x, lb, ub, s):
+    '''1 below lb, 0 above ub, power curve in between'''
+    x = np.asarray(x, dtype=np.float64)
+    desire = np.clip((x - ub) / (lb - ub), 0, 1) ** s
+    
+    # Out of range values explicitly (with s=0 the power curve is 1 everywhere)
+    return np.where(x > ub, 0.0, np.where(x < lb, 1.0, desire))
+
+# Overall desirability of each candidate
+def f_desirability(df, desiriability):
+    '''Weighted geometric mean of the objective desirabilities'''
+    
+    # Objectives, goals and weights (defaults follow the original two objective setup)
+    n_objectives = len(desiriability['lb'])
+    l_objective = desiriability.get('objective', ['evaluation_score', 'feature_size'][:n_objectives])
+    l_goal = desiriability.get('goal', ['max', 'min'][:n_objectives])
+    l_weight = desiriability.get('weight', [1] * n_objectives)
+    
+    # Weighted product of the individual desirabilities
+    desire = 1.0
+    for i in range(n_objectives):
+        if l_goal[i] == 'max':
+            desire_i = f_desire_max(df[l_objective[i]], desiriability['lb'][i], desiriability['ub'][i], desiriability['s'][i])
+        else:
+            desire_i = f_desire_min(df[l_objective[i]], desiriability['lb'][i], desiriability['ub'][i], desiriability['s'][i])
+        desire = desire * desire_i ** l_weight[i]
+    
+    return np.asarray(desire ** (1 / sum(l_weight)), dtype=np.float64)
+
 """This function adds the model performance data to storage as well as calculates the number of features included in the model. The function calls the previous solution evaluation functions in turn. One vital bit of functionality is that it allows the user to alter the fitness function from being purely focussed on the evaluation metric (AUC) to including the number of features as part of the modelling process. This ultimately allows the user to determine how important finding a simple model is compared to optimising purely for AUC."""
 
 # Function to populate attributes of candidates
 def f_population_features(df, features, target, desiriability,
-                          eval_metric, model, kfold, hyperparams):
-    '''Get features of all candidates in population'''
+                          eval_metric, model, kfold, hyperparams, cache=False, pool=False, race=False, fidelity=False, schedule=False, folds=False,
+                          profile=False, scores=False):
+    '''Get features of all candidates in population (scores - evaluation scores which have already been collected)'''
     
     # Calculate feature size for candidates
-    df['feature_size'] = df['features'].apply(len)
+    df['feature_size'] = f_genome_size(df['genomes'])
     
     # Calculate evaluation score for candidates
-    df['evaluation_score'] = f_evaluation_score(df, features, target, eval_metric, model, kfold, hyperparams)
+    if scores != False:
+        evaluation_score = scores
+    elif fidelity != False:
+        evaluation_score = f_successive_halving(df, features, target, eval_metric, model, kfold, hyperparams, 
+                                                schedule=schedule, promote=fidelity.get('promote', 0.33), 
+                                                cache=cache, pool=pool, race=race, folds=folds)
+    else:
+        evaluation_score = f_evaluation_score(df, features, target, eval_metric, model, kfold, hyperparams, cache=cache, pool=pool, race=race, folds=folds)
+    df['evaluation_score'] = evaluation_score['evaluation_score']
+    
+    # Folds run & racing flag
+    if race != False:
+        df['n_folds'] = evaluation_score['n_folds']
+        df['aborted'] = evaluation_score['aborted']
+    
+    # Fidelity rung reached
+    if fidelity != False:
+        df['rung'] = evaluation_score['rung']
+    
+    # Seconds spent cross validating each candidate
+    if profile != False:
+        df['fit_time'] = evaluation_score['fit_time']
     
     # Conditionally create desirability fitness score
     if desiriability != False:
         
-        # Create scalars - Features
-        v_lb_features = desiriability['lb'][1]
-        v_ub_features = desiriability['ub'][1]
-        v_s_features = desiriability['s'][1]
-        
-         # Create scalars - Evaluation Metric
-        v_lb_eval = desiriability['lb'][0]
-        v_ub_eval = desiriability['ub'][0]
-        v_s_eval = desiriability['s'][0]        
-        
-        # Calculate desirability for features
-        df['desire_features']  = [0 if x > v_ub_features else 1 
-                                  if x < v_lb_features else 
-                                      ((x-v_ub_features)/
-                                       (v_lb_features-v_ub_features))**
-                                      v_s_features 
-                                  for x in df['feature_size']]
-    
-        # Calculate desirability for evaluation metric
-        df['desire_eval']  = [0 if x < v_lb_eval else 1
-                              if x > v_ub_eval else 
-                                      ((x-v_lb_eval)/
-                                       (v_ub_eval-v_lb_eval))**
-                                      v_s_eval 
-                              for x in df['evaluation_score']]
-        
         # calculate fitness score
-        df['fitness_score'] = (df['desire_features'] * df['desire_eval'])**0.5
-        
-        # Drop fields
-        df = df.drop(columns=['desire_features', 'desire_eval'])
+        df['fitness_score'] = f_desirability(df, desiriability)
 
     else:        
         # calculate fitness score
@@ -585,6 +1847,191 @@ def f_population_features(df, features, target, desiriability,
     # Return 
     return df
 
+"""**SURROGATE**
+
+Every candidate assessed so far is a (genome, hyperparameters, evaluation score) observation, so a cheap model can predict the score of new offspring before they are cross validated. With a surrogate, each generation after the first:
+
+1. Generates screen times as many crossover offspring as the population needs (the survivors, parents carried over without crossover, are not screened - the surrogate was fitted on them)
+2. Predicts the evaluation score of every variant with a random forest fitted on all the variants assessed so far (the spread of the tree predictions is the uncertainty)
+3. Keeps the candidates with the best predicted variant (exploit) and a share of explore candidates with the most uncertain predictions, and only these are cross validated
+
+The surrogate is refitted on the growing store of assessed variants after every generation (aborted & failed variants are left out) and is only used once the store holds min_rows variants. The rank correlation & mean absolute error of its predictions for the crossover candidates it kept are recorded for each generation.
+"""
+
+# Inputs of the surrogate
+def f_surrogate_inputs(pop):
+    '''Genome flags followed by the hyperparameter values of each variant'''
+    return np.hstack([pop['genomes'], pop['values']]).astype(np.float32)
+
+# Create the surrogate
+def f_surrogate_create(surrogate, seed=False):
+    '''Settings, store of assessed variants & the fitted model of the surrogate'''
+    return {'settings':dict({'screen':5, 'explore':0.2, 'min_rows':50, 'n_estimators':50}, **surrogate),
+            'store':False,
+            'model':False,
+            'random_state':seed if seed is not False else None}
+
+# Scored variants of a population
+def f_surrogate_observations(pop):
+    '''Inputs & evaluation scores of the variants which were fully scored'''
+    rows = np.isfinite(pop['evaluation_score'])
+    if 'aborted' in pop:
+        rows &= ~pop['aborted']
+    return {'inputs':f_surrogate_inputs(pop)[rows], 'score':pop['evaluation_score'][rows]}
+
+# Add assessed variants to the surrogate & refit it
+def f_surrogate_update(surr, observations):
+    '''Store the observations & refit the model on every stored variant'''
+    if surr['store'] == False:
+        surr['store'] = f_history_create(observations, capacity=max(len(observations['score']), 1) * 10)
+    f_history_append(surr['store'], observations)
+    
+    # Refit once enough variants are stored
+    if surr['store']['size'] >= surr['settings']['min_rows']:
+        store = f_history_view(surr['store'])
+        surr['model'] = RandomForestRegressor(n_estimators=surr['settings']['n_estimators'], min_samples_leaf=2,
+                                              random_state=surr['random_state']).fit(store['inputs'], store['score'])
+
+# Predict with the surrogate
+def f_surrogate_predict(surr, pop):
+    '''Mean & spread of the tree predictions for each variant'''
+    inputs = f_surrogate_inputs(pop)
+    predictions = np.stack([tree.predict(inputs) for tree in surr['model'].estimators_])
+    return predictions.mean(axis=0), predictions.std(axis=0)
+
+# Screen offspring with the surrogate
+def f_surrogate_screen(surr, pop, n_keep):
+    '''Variants of the n_keep most promising / uncertain candidates (renumbered) & their predicted scores'''
+    v_mean, v_std = f_surrogate_predict(surr, pop)
+    
+    # Best predicted variant of each candidate & its uncertainty
+    candidates, inverse = np.unique(pop['candidate'], return_inverse=True)
+    order = np.lexsort((-v_mean, inverse))
+    first = order[np.concatenate([[True], inverse[order][1:] != inverse[order][:-1]])]
+    
+    # Exploit the best predictions, explore the most uncertain of the rest
+    n_exploit = min(int(round(n_keep * (1 - surr['settings']['explore']))), n_keep)
+    keep = np.argsort(-v_mean[first], kind='stable')[:n_exploit]
+    rest = np.setdiff1d(np.arange(len(candidates)), keep)
+    keep = np.sort(np.concatenate([keep, rest[np.argsort(-v_std[first][rest], kind='stable')[:n_keep - n_exploit]]]))
+    
+    # Variants of the kept candidates, numbered from zero
+    rows = np.flatnonzero(np.isin(inverse, keep))
+    pop = f_population_take(pop, rows)
+    pop['candidate'] = np.searchsorted(candidates[keep], pop['candidate'])
+    return pop, v_mean[rows]
+
+# Accuracy of the surrogate
+def f_surrogate_accuracy(surr, predicted, pop):
+    '''Rank correlation & mean absolute error of the predictions for the variants which were scored'''
+    rows = np.isfinite(pop['evaluation_score'])
+    if 'aborted' in pop:
+        rows &= ~pop['aborted']
+    accuracy = {'rank_corr':np.nan, 'mae':np.nan, 'n_scored':int(rows.sum()), 'n_train':surr['store']['size']}
+    if rows.sum() > 1:
+        accuracy['rank_corr'] = float(stats.spearmanr(predicted[rows], pop['evaluation_score'][rows])[0])
+        accuracy['mae'] = float(np.mean(np.abs(predicted[rows] - pop['evaluation_score'][rows])))
+    return accuracy
+
+"""**CHECKPOINTS**
+
+The state of a run is written to a checkpoint file after each generation so a crash or pre-emption does not lose the generations already run. The checkpoint is a single .npz file holding:
+
+1. The current population, the elite candidates & the search history (one array per field)
+2. The state of the random number generator
+3. The evaluation cache (pickled), generations without improvement, the global best & whether the run has stopped
+4. The fold splits & fidelity row subsamples, so the resumed run scores candidates on the same rows
+
+It is written to a temporary file which then replaces the previous checkpoint, so a checkpoint is never left half written. Passing the file as resume_from continues the run from the generation after the checkpoint exactly as if it had never stopped (the other arguments must be the same as the original run).
+"""
+
+# Save the state of a run
+def f_checkpoint_save(path, gen, pop, history, cache, count, v_best, schedule, folds, pop_elite=False, stopped=False, surrogate=False):
+    '''Write the run state to an .npz file, replacing the previous checkpoint atomically'''
+    state = {'gen':np.int64(gen), 'count':np.int64(count), 'v_best':np.float64(v_best), 'stopped':np.bool_(stopped)}
+    
+    # Population, elite & history
+    for field in pop:
+        state['pop__' + field] = pop[field]
+    if pop_elite != False:
+        for field in pop_elite:
+            state['elite__' + field] = pop_elite[field]
+    if history != False:
+        for field, arr in f_history_view(history).items():
+            state['history__' + field] = arr
+    
+    # Random number generator
+    rng_kind, rng_keys, rng_pos, rng_has_gauss, rng_cached_gaussian = rnd.get_state()
+    state['rng_keys'] = rng_keys
+    state['rng_state'] = np.array([rng_pos, rng_has_gauss, rng_cached_gaussian], dtype=np.float64)
+    
+    # Evaluation cache
+    if cache != False:
+        state['cache'] = np.frombuffer(pickle.dumps(cache, protocol=pickle.HIGHEST_PROTOCOL), dtype=np.uint8)
+    
+    # Folds & fidelity rows
+    if folds != False:
+        for i, fold in enumerate(folds):
+            state['fold_train__' + str(i)] = fold['train']
+            state['fold_test__' + str(i)] = fold['test']
+    if schedule != False:
+        for i, rung in enumerate(schedule):
+            if rung['rows'] is not False:
+                state['rung_rows__' + str(i)] = rung['rows']
+    
+    # Variants stored by the surrogate
+    if (surrogate != False) and (surrogate['store'] != False):
+        for field, arr in f_history_view(surrogate['store']).items():
+            state['surrogate__' + field] = arr
+    
+    # Write then rename over the previous checkpoint
+    path_tmp = path + '.tmp'
+    with open(path_tmp, 'wb') as f:
+        np.savez(f, **state)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path_tmp, path)
+
+# Load the state of a run
+def f_checkpoint_load(path):
+    '''Run state written by f_checkpoint_save'''
+    with np.load(path, allow_pickle=False) as npz:
+        state = {'gen':int(npz['gen']), 'count':int(npz['count']), 'v_best':float(npz['v_best']), 'stopped':bool(npz['stopped']),
+                 'pop':{}, 'elite':{}, 'history':{}, 'surrogate':{}, 'cache':False, 'folds':False, 'rung_rows':{}}
+        
+        # Population, elite & history (fields in the order they were saved)
+        for name in npz.files:
+            if name.startswith('pop__'):
+                state['pop'][name[len('pop__'):]] = npz[name]
+            elif name.startswith('elite__'):
+                state['elite'][name[len('elite__'):]] = npz[name]
+            elif name.startswith('history__'):
+                state['history'][name[len('history__'):]] = npz[name]
+            elif name.startswith('rung_rows__'):
+                state['rung_rows'][int(name[len('rung_rows__'):])] = npz[name]
+            elif name.startswith('surrogate__'):
+                state['surrogate'][name[len('surrogate__'):]] = npz[name]
+        
+        # Random number generator
+        rng_pos, rng_has_gauss, rng_cached_gaussian = npz['rng_state']
+        state['rng'] = ('MT19937', npz['rng_keys'], int(rng_pos), int(rng_has_gauss), float(rng_cached_gaussian))
+        
+        # Evaluation cache
+        if 'cache' in npz.files:
+            state['cache'] = pickle.loads(npz['cache'].tobytes())
+        
+        # Fold splits
+        n_folds = len([name for name in npz.files if name.startswith('fold_train__')])
+        if n_folds > 0:
+            state['folds'] = [(npz['fold_train__' + str(i)], npz['fold_test__' + str(i)]) for i in range(n_folds)]
+    
+    # Runs without elitism / history / surrogate
+    for field in ['elite', 'history', 'surrogate']:
+        if len(state[field]) == 0:
+            state[field] = False
+    
+    return state
+
 """Wrapper function which controls the optimisation process in it's entiriety, it allows the user to state the parameters of the search including:
 
 1. Evaluation metrics (any metric accepted by sklearn)
@@ -595,121 +2042,826 @@ def f_population_features(df, features, target, desiriability,
 5. Mutation rate
 5. Elitism
 6. Maximum generations without improvement
+7. Size of the evaluation cache (set to false to re-evaluate every candidate)
+8. Number of worker processes used to evaluate candidates
+9. Diversity tracking (one minus the mean pairwise similarity of each candidate to the rest of its generation)
+10. Racing settings for aborting weak candidates before all folds are run
+11. Multi-fidelity schedule (successive halving over row subsamples / cheaper model settings)
+12. Fold cache (split the data into folds once per run, set to false to let each candidate re-split the dataframe)
+13. Checkpoint file written after each generation & a checkpoint to resume from
+14. Callbacks called with the record of each generation (return True to stop the run)
+15. Seed of the random streams (set to false to use the global numpy.random state)
+16. Profiling (wall time, CPU time & peak memory of each phase of each generation, fit time of each candidate)
+17. Prefilter (variance & correlation thresholds, drops constant, duplicated & correlated columns before the search)
+18. Surrogate (screen multiple, explore share, minimum stored variants & trees of the random forest which screens the offspring)
+19. Steady state (breed & dispatch a child whenever a worker is free instead of waiting for whole generations)
+20. Binned folds (XGBoost histogram models fit on bin codes cut once per fold instead of the raw features)
+
+The search itself is a generator, f_model_optimisation_stream, which yields a compact record after each generation:
+
+* generation, mean & best fitness of the generation, global best & generations without improvement
+* best candidate of the generation (feature positions, hyperparameters, fitness & evaluation score)
+* timings of the generation (generate, evaluate, select & total seconds)
+* cache stats
+
+so a run can be monitored, stopped (close the generator or return True from a callback), given a new budget (send {'generations':n}) or sent candidates from another run which replace the weakest of the current population (send {'migrants':population}) while it is going. With top_k the record also holds the top k candidates of the generation. With keep_history=False only the current population and the elite candidates are held in memory. f_model_optimisation runs the stream to the end and returns every candidate assessed as a dataframe.
 """
 
-# Main Optimisation Function
-def f_model_optimisation(df, target_var, generations,  population, eval_metric, model, kfold=False, hyperparams_multiple = 3, hyperparams = False, 
-                         desiriability=False,p_crossover=0.8, p_mutate=0.01, hyperparams_increment = 0.1, elitism=False, gens_no_improve = False, initalise = False):
-    '''Function uses GA's to choose features and tune hyperparameters'''
+"""**INSTRUMENTATION**
+
+With profile=True each phase of a generation is measured:
+
+* generate - crossover & mutation of the new population
+* evaluate - cross validation of the candidates, with a summary of the seconds spent fitting each variant (fit_time of the variant kept is also stored in the history, 0 when its score came from the cache)
+* best_variant - reduction to the best variant of each candidate
+* similarity - similarity & probability
+* history - storing the generation & the elite candidates
+* checkpoint - writing the checkpoint (added to the record after the callbacks have run)
+
+For each phase the wall time, CPU time of the main process (worker processes are covered by fit_time) and peak memory allocated by Python/NumPy during the phase (tracemalloc) are recorded. The metrics of each generation are in the 'profile' entry of its record and f_model_optimisation returns them in df_output.attrs['profile']. When profile is off the phases are not measured.
+"""
+
+# Start measuring a phase
+def f_phase_start(profile):
+    '''Wall & CPU clock at the start of the phase (False when not profiling)'''
+    if profile == False:
+        return False
+    tracemalloc.reset_peak()
+    return (time.perf_counter(), time.process_time())
+
+# Finish measuring a phase
+def f_phase_end(metrics, phase, start):
+    '''Store wall seconds, CPU seconds & peak allocated MB of the phase'''
+    if start == False:
+        return
+    metrics[phase] = {'wall':time.perf_counter() - start[0],
+                      'cpu':time.process_time() - start[1],
+                      'peak_mb':tracemalloc.get_traced_memory()[1] / 2**20}
+
+# Summary of the fit times of a generation
+def f_fit_time_summary(fit_time):
+    '''Total, mean & max seconds cross validating & number of candidates fitted'''
+    return {'total':float(fit_time.sum()),
+            'mean':float(fit_time.mean()),
+            'max':float(fit_time.max()),
+            'n_fitted':int(np.count_nonzero(fit_time))}
+
+# Compact summary of a generation
+def f_generation_record(gen, pop, v_best, count, timings, cache, hyperP):
+    '''Scores, best candidate, timings & cache stats of a generation'''
+    idx_best = int(np.nanargmax(pop['fitness_score']))
+    if hyperP != False:
+        best_hyperparams = f_hyperparams_from_array(pop['values'][idx_best:idx_best + 1], hyperP)[0]
+    else:
+        best_hyperparams = False
+    return {'generation':gen,
+            'mean':float(np.mean(pop['fitness_score'])),
+            'best':float(np.max(pop['fitness_score'])),
+            'global_best':float(v_best),
+            'gens_no_improve':count,
+            'best_candidate':{'candidate':int(pop['candidate'][idx_best]),
+                              'features':f_genome_to_idx(pop['genomes'][idx_best]),
+                              'hyperparameters':best_hyperparams,
+                              'fitness_score':float(pop['fitness_score'][idx_best]),
+                              'evaluation_score':float(pop['evaluation_score'][idx_best])},
+            'time':timings,
+            'cache':f_cache_stats(cache) if cache != False else False}
+
+# Progress of a generation as text
+def f_record_text(record):
+    '''Generation mean, generation best & global best (and the surrogate accuracy when screening)'''
+    text = ('Gen: ' + str(record['generation']).zfill(2) +
+            ' - Generation Mean:' + str(round(record['mean'], 4)).zfill(4) +
+            ' - Generation Best:' + str(round(record['best'], 4)).zfill(4) +
+            ' - Global Best:' + str(round(record['global_best'], 4)).zfill(4))
+    if record.get('surrogate', False) != False:
+        text += (' - Surrogate Rank Corr:' + str(round(record['surrogate']['rank_corr'], 4)) +
+                 ' - Surrogate MAE:' + str(round(record['surrogate']['mae'], 4)))
+    return text
+
+# Print the progress of a generation
+def f_callback_print(record):
+    '''Print the record of a generation'''
+    print(f_record_text(record))
+
+# Elite candidates of the search so far
+def f_elite_update(pop_elite, pop, elitism):
+    '''Top candidates of the previous elite & the latest generation (earliest first among ties)'''
+    if pop_elite != False:
+        pop = f_population_concat([pop_elite, pop])
+    idx_elite = np.argsort(-pop['fitness_score'], kind='stable')[:elitism]
+    return f_population_take(pop, idx_elite)
+
+# Bring migrants into a population
+def f_population_migrate(pop, migrants, pairwise=False):
+    '''Migrants replace the weakest candidates (keeping their candidate numbers), then probabilities are recalculated'''
+    n_migrants = min(len(migrants['candidate']), len(pop['candidate']))
+    idx_worst = np.argsort(pop['fitness_score'], kind='stable')[:n_migrants]
+    pop = {field:pop[field].copy() for field in pop}
+    for field in pop:
+        if field not in ['generation', 'candidate']:
+            pop[field][idx_worst] = migrants[field][:n_migrants]
+    return f_sim_n_prob(pop, pairwise=pairwise)
+
+"""**STEADY STATE**
+
+With generations every worker waits for the slowest candidate of a generation before the next one is bred, e.g. XGBoost variants with max_depth=15 take around 10 times longer than those with max_depth=2. With steady_state=True only the first generation is scored as a whole, after that the GA runs without generation barriers:
+
+1. Whenever a worker is free a single child is bred from the breeding pool (crossover of two parents with probability p_crossover, otherwise a selected parent, then mutation - the operators of a generation) and dispatched at once
+2. When the cross validation of a child completes, its best variant joins the pool and the weakest candidate is dropped (the pool holds the best population candidates so far, so elitism is implicit), then the probabilities of the pool are recalculated
+3. Every population children which complete form an evaluation batch, which is recorded & stored in the history as a generation (in order of completion, similarities within the batch)
+
+The k-th child dispatched is numbered candidate population + k, so candidate numbers are unique over the run (the first generation is 0 to population - 1) and a child keeps its number in the breeding pool and the history.
+
+Children still running at the end of a batch carry on into the next one, so workers never sit idle waiting for a batch. With a seed the k-th child dispatched draws from stream (1 + k // population, k % population), the pool it is bred from depends on the order in which children complete though, so only runs with one worker are reproducible. Racing thresholds come from the pool when a child is dispatched. Fidelity, surrogate screening & checkpoints work on whole generations and are not supported in steady state mode.
+"""
+
+# Breed one child from the breeding pool
+def f_steady_state_breed(pop_pool, child, population, features_name, p_crossover, p_mutate, hyperparams, hyperparams_increment, hyperparams_multiple, seed=False):
+    '''Variants of the child-th child dispatched (crossover with probability p_crossover, otherwise a selected parent, then mutation)'''
+    
+    # Stream of the child
+    if seed is not False:
+        rng_child = f_rng(seed, 1 + child // population, child % population)
+        v_crossover = rng_child.random()
+        rng = {'generation':rng_child, 'candidate':[rng_child]}
+    else:
+        v_crossover = rnd.random_sample()
+        rng = False
+    
+    return f_generate_population(inital_flag=False, population=1, features_name=features_name, df=pop_pool,
+                                 p_crossover=float(v_crossover < p_crossover), p_mutate=p_mutate, hyperparams=hyperparams,
+                                 hyperparams_increment=hyperparams_increment, hyperparams_multiple=hyperparams_multiple, rng=rng)
+
+# Add a scored child to the breeding pool
+def f_steady_state_insert(pop_pool, child, population, pairwise=False):
+    '''Best population candidates of the pool & the child (the child is kept over tied candidates), probabilities recalculated'''
+    pop_pool = f_population_concat([child, pop_pool])
+    pop_pool = f_population_take(pop_pool, np.sort(np.argsort(-pop_pool['fitness_score'], kind='stable')[:population]))
+    return f_sim_n_prob(pop_pool, pairwise=pairwise)
+
+# Streaming Optimisation Function
+def f_model_optimisation_stream(df, target_var, generations,  population, eval_metric, model, kfold=False, hyperparams_multiple = 3, hyperparams = False, 
+                                desiriability=False,p_crossover=0.8, p_mutate=0.01, hyperparams_increment = 0.1, elitism=False, gens_no_improve = False, initalise = False,
+                                cache_size = 10000, n_workers = 1, diversity = False, race = False, fidelity = False, fold_cache = True,
+                                checkpoint = False, resume_from = False, callbacks = False, seed = False, profile = False, keep_history = True, top_k = False,
+                                surrogate = False, steady_state = False, prefilter = False, bin_folds = False):
+    '''Generator running the GA, yields a record of each generation & returns the search history'''
+    
+    # Settings which work on whole generations
+    if (steady_state != False) and ((fidelity != False) or (surrogate != False) or (checkpoint != False) or (resume_from != False)):
+        raise ValueError('Fidelity, surrogate screening & checkpoints are not supported in steady state mode')
+    
+    # Cache of evaluated candidates
+    if cache_size != False:
+        cache = f_cache_create(max_size=cache_size)
+    else:
+        cache = False
+    
+    # Drop constant, duplicated & correlated columns (genomes handed out are mapped back to the original columns)
+    if prefilter != False:
+        n_features_original = df.shape[1] - 1
+        df, initalise, idx_keep = f_prefilter_apply(df, target_var, prefilter, initalise=initalise)
     
-    # Print Model Stats
-    print('Model Initialisation')
     # Split features and target
     features = df.drop(target_var,axis=1)
     features_name = features.columns
     target = df[target_var]
     
-    # First Generation
-    # Generate inital candidate features solutions
-    df_pop_cur = f_generate_population(inital_flag=True, population=population, features_name=features_name, p_crossover=p_crossover, 
-                                       p_mutate=p_mutate, hyperparams=hyperparams, hyperparams_increment=hyperparams_increment,
-                                       hyperparams_multiple=hyperparams_multiple, initalise=initalise)
+    # State of the run to resume
+    if resume_from != False:
+        state = f_checkpoint_load(resume_from)
+        if (cache != False) and (state['cache'] != False):
+            cache = state['cache']
     
-    # Enrich candidate solutions with features
-    df_pop_cur = f_population_features(df=df_pop_cur, features=features, target=target, desiriability=desiriability,
-                                       eval_metric=eval_metric, model=model, kfold=kfold, hyperparams=hyperparams)
+    # Row subsamples of the fidelity rungs
+    if fidelity != False:
+        schedule = f_fidelity_schedule(target, fidelity, rng=f_rng(seed) if seed is not False else False)
+        if resume_from != False:
+            for i, rung in enumerate(schedule):
+                if i in state['rung_rows']:
+                    rung['rows'] = state['rung_rows'][i]
+    else:
+        schedule = False
     
-    # Extract best score for each candidate
-    df_pop_cur = df_pop_cur.loc[df_pop_cur.reset_index().groupby(['candidate'])['fitness_score'].idxmax()]
+    # Folds shared by every candidate of the run
+    if fold_cache != False:
+        folds = f_fold_cache(features, target, kfold, model, splits=state['folds'] if resume_from != False else False, bin_folds=bin_folds)
+    else:
+        folds = False
     
-    # Enrich candidate solutions with similarity & probability
-    df_pop_cur = f_sim_n_prob(df_pop_cur)
+    # Surrogate of the evaluation score
+    if surrogate != False:
+        surr = f_surrogate_create(surrogate, seed=seed)
+        if (resume_from != False) and (state['surrogate'] != False):
+            f_surrogate_update(surr, state['surrogate'])
+    else:
+        surr = False
     
-    # Create search storage
-    df_output = df_pop_cur.copy()
-
-    # Print Model Stats
-    print('Gen: 00' +
-          ' - Generation Mean:' + str(round(df_output.fitness_score.mean(), 4)).zfill(4) +
-          ' - Generation Best:' + str(round(df_output.fitness_score.max(), 4)).zfill(4) +
-          ' - Global Best:' + str(round(df_output.fitness_score.max(), 4)).zfill(4)
-          )
-    
-    # Track best solution
-    if gens_no_improve != False:
-        count = 0
-        v_best = df_output.fitness_score.max()
-    
-    #Run additional generations 
-    # Loop for additional generations
-    for gen in range(1, generations):
+    # Start worker pool
+    if n_workers > 1:
+        pool = f_pool_start(features, target, model, eval_metric, kfold, n_workers, schedule=schedule, folds=folds)
+    else:
+        pool = False
+    
+    # Callbacks
+    if callbacks == False:
+        callbacks = []
+    
+    # Trace allocations while profiling
+    profile_trace = (profile != False) and (not tracemalloc.is_tracing())
+    if profile_trace:
+        tracemalloc.start()
+    
+    try:
+        # No race threshold until a generation has been scored
+        if race != False:
+            race_gen = dict(race, threshold=None)
+        else:
+            race_gen = False
+        
+        # Resume after the checkpointed generation
+        if resume_from != False:
+            pop_cur = state['pop']
+            pop_elite = state['elite']
+            if keep_history:
+                history = f_history_create(pop_cur, capacity=generations * population)
+                if state['history'] != False:
+                    f_history_append(history, state['history'])
+            else:
+                history = False
+            count = state['count']
+            v_best = state['v_best']
+            gen = state['gen'] + 1
+            rnd.set_state(state['rng'])
+            
+            # Run had already stopped
+            if state['stopped']:
+                gen = generations
+            del state
+            
+        else:
+            # First Generation
+            time_start = time.perf_counter()
+            metrics = {}
+            phase = f_phase_start(profile)
+            
+            # Generate inital candidate features solutions
+            pop_cur = f_generate_population(inital_flag=True, population=population, features_name=features_name, p_crossover=p_crossover, 
+                                            p_mutate=p_mutate, hyperparams=hyperparams, hyperparams_increment=hyperparams_increment,
+                                            hyperparams_multiple=hyperparams_multiple, initalise=initalise,
+                                            rng=f_rng_generation(seed, 0, population) if seed is not False else False)
+            f_phase_end(metrics, 'generate', phase)
+            time_generate = time.perf_counter()
+        
+            # Enrich candidate solutions with features
+            phase = f_phase_start(profile)
+            pop_cur = f_population_features(df=pop_cur, features=features, target=target, desiriability=desiriability,
+                                            eval_metric=eval_metric, model=model, kfold=kfold, hyperparams=hyperparams,
+                                            cache=cache, pool=pool, race=race_gen, fidelity=fidelity, schedule=schedule, folds=folds,
+                                            profile=profile)
+            f_phase_end(metrics, 'evaluate', phase)
+            if profile != False:
+                metrics['fit_time'] = f_fit_time_summary(pop_cur['fit_time'])
+            time_evaluate = time.perf_counter()
+            
+            # Fit the surrogate on the scored variants
+            if surrogate != False:
+                phase = f_phase_start(profile)
+                f_surrogate_update(surr, f_surrogate_observations(pop_cur))
+                f_phase_end(metrics, 'surrogate', phase)
+        
+            # Extract best score for each candidate
+            phase = f_phase_start(profile)
+            pop_cur = f_population_best_variant(pop_cur)
+            f_phase_end(metrics, 'best_variant', phase)
+        
+            # Enrich candidate solutions with similarity & probability
+            phase = f_phase_start(profile)
+            pop_cur = f_sim_n_prob(pop_cur, pairwise=diversity)
+            f_phase_end(metrics, 'similarity', phase)
+            time_select = time.perf_counter()
+        
+            # Create search storage, preallocated for every generation
+            phase = f_phase_start(profile)
+            if keep_history:
+                history = f_history_create(pop_cur, capacity=generations * population)
+                f_history_append(history, pop_cur)
+            else:
+                history = False
+            v_best = np.nanmax(pop_cur['fitness_score'])
+            
+            # Elite candidates
+            if elitism > 0:
+                pop_elite = f_elite_update(False, pop_cur, elitism)
+            else:
+                pop_elite = False
+        
+            # Track best solution
+            count = 0
+            gen = 0
+        
+        # Breeding pool & children in flight of the steady state scheduler
+        if steady_state != False:
+            pop_pool = pop_cur
+            d_inflight = {}
+            n_dispatched = 0
+            n_slots = pool['n_workers'] if pool != False else 1
+        
+        #Run additional generations 
+        # Loop for additional generations
+        while gen < generations:
+            surr_accuracy = False
+            
+            # Batch of children completed by the steady state scheduler
+            if (gen > 0) and (steady_state != False):
+                time_start = time.perf_counter()
+                metrics = {}
+                v_generate = 0.0
+                v_evaluate = 0.0
+                l_batch = []
+                while len(l_batch) < population:
+                    
+                    # Breed & dispatch a child while a worker is free (up to the number of children the run still needs)
+                    if (len(d_inflight) < n_slots) and (n_dispatched < (generations - 1) * population):
+                        time_phase = time.perf_counter()
+                        child = f_steady_state_breed(pop_pool, n_dispatched, population, features_name, p_crossover, p_mutate, 
+                                                     hyperparams, hyperparams_increment, hyperparams_multiple, seed=seed)
+                        child['candidate'][:] = population + n_dispatched
+                        if race != False:
+                            race_child = dict(race, threshold=f_race_threshold(pop_pool, race))
+                        else:
+                            race_child = False
+                        evaluation = f_evaluation_tasks(child, model, eval_metric, kfold, hyperparams, cache=cache, race=race_child)
+                        n_dispatched += 1
+                        v_generate += time.perf_counter() - time_phase
+                        
+                        # The variants of a child share its feature set, they run as one batch on one worker
+                        if (pool != False) and (len(evaluation['tasks']) > 0):
+                            d_inflight[pool['executor'].submit(f_worker_fitness_tasks, evaluation['tasks'])] = (n_dispatched, child, evaluation)
+                            continue
+                        
+                        # Every variant was cached (or there is no pool), the child completes at once
+                        time_phase = time.perf_counter()
+                        l_scores = f_evaluation_run(evaluation['tasks'], features, target, eval_metric, model, kfold, folds=folds)
+                        v_evaluate += time.perf_counter() - time_phase
+                    
+                    # Wait for a child to complete (the earliest dispatched when several have)
+                    elif len(d_inflight) > 0:
+                        time_phase = time.perf_counter()
+                        done, _ = wait(d_inflight, return_when=FIRST_COMPLETED)
+                        future = min(done, key=lambda future: d_inflight[future][0])
+                        _, child, evaluation = d_inflight.pop(future)
+                        l_scores = future.result()
+                        v_evaluate += time.perf_counter() - time_phase
+                    
+                    # Budget of the run used up
+                    else:
+                        break
+                    
+                    # Score the child & keep its best variant in the batch and the pool
+                    evaluation_score = f_evaluation_collect(evaluation, l_scores, target, model, kfold, cache=cache, folds=folds)
+                    child = f_population_features(df=child, features=features, target=target, desiriability=desiriability,
+                                                  eval_metric=eval_metric, model=model, kfold=kfold, hyperparams=hyperparams,
+                                                  race=race, profile=profile, scores=evaluation_score)
+                    child = f_population_best_variant(child)
+                    child['generation'][:] = gen
+                    l_batch.append(child)
+                    pop_pool = f_steady_state_insert(pop_pool, child, population, pairwise=diversity)
+                    del evaluation, evaluation_score, l_scores
+                time_generate = time_start + v_generate
+                time_evaluate = time_generate + v_evaluate
+                if profile != False:
+                    metrics['fit_time'] = f_fit_time_summary(np.concatenate([child['fit_time'] for child in l_batch]))
+                
+                # Enrich the batch with similarity & probability
+                phase = f_phase_start(profile)
+                pop_cur = f_sim_n_prob(df=f_population_concat(l_batch), pairwise=diversity)
+                f_phase_end(metrics, 'similarity', phase)
+                time_select = time.perf_counter()
+                del l_batch
+                
+                # Update Output
+                phase = f_phase_start(profile)
+                if keep_history:
+                    f_history_append(history, pop_cur)
+                v_best_gen = np.nanmax(pop_cur['fitness_score'])
                 
-        # Elitism 
-        if elitism > 0:
+                # Track number of generations with no improvement
+                if gens_no_improve != False:
+                    if v_best_gen > v_best:
+                        count = 0
+                    else:
+                        count += 1
+                v_best = max(v_best, v_best_gen)
             
-            # Create a dataframe with elite candidates
-            df_elite = df_output.nlargest(columns='fitness_score', n=elitism)
-            df_elite['candidate'] = population - 1
-            df_elite['generation'] = gen 
-            df_elite = df_elite.drop(columns=['similarity_features', 
-                                              'similarity_hyperparameters', 'probability'])
-        # New Population
-        
-        # Generate next candidate solutions   
-        df_pop_cur = f_generate_population(inital_flag=False, 
-                                           generation = gen,
-                                           population=(population-elitism),
-                                           features_name=features_name,
-                                           df=df_pop_cur,
-                                           p_crossover=p_crossover,
-                                           p_mutate=p_mutate,
-                                           hyperparams=hyperparams,
-                                           hyperparams_increment=hyperparams_increment,
-                                           hyperparams_multiple=hyperparams_multiple
-                                           )
-        
-        # Enrich candidate solutions with features
-        df_pop_cur = f_population_features(df=df_pop_cur, 
-                                           features=features, 
-                                           target=target,
-                                           desiriability=desiriability,
-                                           eval_metric=eval_metric,
-                                           model=model,
-                                           kfold=kfold,
-                                           hyperparams=hyperparams)
-        
-        # Add elite
-        if elitism > 0:
-            df_pop_cur = pd.concat([df_pop_cur, df_elite]).reset_index().drop(columns=['index'])
-            del df_elite
-               
-        # Extract best score for each candidate
-        df_pop_cur = df_pop_cur.loc[df_pop_cur.reset_index().groupby(['candidate'])['fitness_score'].idxmax()]        
-        
-        # Enrich candidate solutions with similarity & probability
-        df_pop_cur = f_sim_n_prob(df=df_pop_cur)
-        
-        # Update Output
-        df_output = df_output.append(df_pop_cur,ignore_index=True)
+            # First generation has already been scored
+            elif gen > 0:
+                time_start = time.perf_counter()
+                metrics = {}
+                phase = f_phase_start(profile)
+                    
+                # Elitism 
+                if elitism > 0:
                 
-        # Print Model Stats
-        print('Gen: ' + str(gen).zfill(2) +
-              ' - Generation Mean:' + str(round(df_output[df_output.generation == gen].fitness_score.mean(), 4)).zfill(4) +
-              ' - Generation Best:' + str(round(df_output[df_output.generation == gen].fitness_score.max(), 4)).zfill(4) +
-              ' - Global Best:' + str(round(df_output.fitness_score.max(), 4)).zfill(4))
-        
-        # Track number of generations with no improvement
-        if gens_no_improve != False:
-            if df_output.fitness_score.max() > v_best:
-                count = 0
-                v_best = df_output.fitness_score.max()
-            else:
-                count += 1
-
+                    # Elite candidates of the search so far
+                    pop_add = f_population_take(pop_elite, np.arange(len(pop_elite['candidate'])))
+                    pop_add['candidate'][:] = population - 1
+                    pop_add['generation'][:] = gen
+                    if profile != False:
+                        pop_add['fit_time'][:] = 0
+                
+                # Race threshold from the previous generation
+                if race != False:
+                    race_gen = dict(race, threshold=f_race_threshold(pop_cur, race))
+                # New Population
+                
+                # Generate extra crossover offspring for the surrogate to screen (the survivors without crossover are not screened)
+                n_offspring = population - elitism
+                n_crossover = round(n_offspring * p_crossover)
+                if (surrogate != False) and (surr['model'] != False) and (n_crossover > 0):
+                    crossover_multiple = surr['settings']['screen']
+                else:
+                    crossover_multiple = 1
+                n_generate = n_crossover * crossover_multiple + n_offspring - n_crossover
+            
+                # Generate next candidate solutions   
+                pop_cur = f_generate_population(inital_flag=False, 
+                                                generation = gen,
+                                                population=n_offspring,
+                                                crossover_multiple=crossover_multiple,
+                                                features_name=features_name,
+                                                df=pop_cur,
+                                                p_crossover=p_crossover,
+                                                p_mutate=p_mutate,
+                                                hyperparams=hyperparams,
+                                                hyperparams_increment=hyperparams_increment,
+                                                hyperparams_multiple=hyperparams_multiple,
+                                                rng=f_rng_generation(seed, gen, max(population, n_generate)) if seed is not False else False
+                                                )
+                f_phase_end(metrics, 'generate', phase)
+                
+                # Keep the most promising / uncertain crossover offspring, the survivors are numbered after them
+                if crossover_multiple > 1:
+                    phase = f_phase_start(profile)
+                    is_crossover = pop_cur['candidate'] < n_crossover * crossover_multiple
+                    pop_crossover, surr_predicted = f_surrogate_screen(surr, f_population_take(pop_cur, np.flatnonzero(is_crossover)), n_crossover)
+                    pop_survivor = f_population_take(pop_cur, np.flatnonzero(~is_crossover))
+                    pop_survivor['candidate'] -= n_crossover * (crossover_multiple - 1)
+                    pop_cur = f_population_concat([pop_crossover, pop_survivor])
+                    del pop_crossover, pop_survivor, is_crossover
+                    f_phase_end(metrics, 'screen', phase)
+                time_generate = time.perf_counter()
+            
+                # Enrich candidate solutions with features
+                phase = f_phase_start(profile)
+                pop_cur = f_population_features(df=pop_cur, 
+                                                features=features, 
+                                                target=target,
+                                                desiriability=desiriability,
+                                                eval_metric=eval_metric,
+                                                model=model,
+                                                kfold=kfold,
+                                                hyperparams=hyperparams,
+                                                cache=cache,
+                                                pool=pool,
+                                                race=race_gen,
+                                                fidelity=fidelity,
+                                                schedule=schedule,
+                                                folds=folds,
+                                                profile=profile)
+                f_phase_end(metrics, 'evaluate', phase)
+                if profile != False:
+                    metrics['fit_time'] = f_fit_time_summary(pop_cur['fit_time'])
+                time_evaluate = time.perf_counter()
+                
+                # Accuracy of the screening & refit of the surrogate
+                if surrogate != False:
+                    phase = f_phase_start(profile)
+                    if crossover_multiple > 1:
+                        surr_accuracy = f_surrogate_accuracy(surr, surr_predicted, f_population_take(pop_cur, np.arange(len(surr_predicted))))
+                    f_surrogate_update(surr, f_surrogate_observations(pop_cur))
+                    f_phase_end(metrics, 'surrogate', phase)
+            
+                # Add elite
+                phase = f_phase_start(profile)
+                if elitism > 0:
+                    pop_cur = f_population_concat([pop_cur, pop_add])
+                    del pop_add
+                   
+                # Extract best score for each candidate
+                pop_cur = f_population_best_variant(pop_cur)
+                f_phase_end(metrics, 'best_variant', phase)
+            
+                # Enrich candidate solutions with similarity & probability
+                phase = f_phase_start(profile)
+                pop_cur = f_sim_n_prob(df=pop_cur, pairwise=diversity)
+                f_phase_end(metrics, 'similarity', phase)
+                time_select = time.perf_counter()
+            
+                # Update Output
+                phase = f_phase_start(profile)
+                if keep_history:
+                    f_history_append(history, pop_cur)
+                if elitism > 0:
+                    pop_elite = f_elite_update(pop_elite, pop_cur, elitism)
+                v_best_gen = np.nanmax(pop_cur['fitness_score'])
+            
+                # Track number of generations with no improvement
+                if gens_no_improve != False:
+                    if v_best_gen > v_best:
+                        count = 0
+                    else:
+                        count += 1
+                v_best = max(v_best, v_best_gen)
+            f_phase_end(metrics, 'history', phase)
+            
+            # Record of the generation
+            record = f_generation_record(gen, pop_cur, v_best, count,
+                                         {'generate':time_generate - time_start,
+                                          'evaluate':time_evaluate - time_generate,
+                                          'select':time_select - time_evaluate,
+                                          'total':time_select - time_start},
+                                         cache, hyperparams)
+            
+            # Top candidates of the generation (e.g. for migration)
+            if top_k != False:
+                record['top'] = f_population_take(pop_cur, np.argsort(-pop_cur['fitness_score'], kind='stable')[:top_k])
+            
+            # Phase metrics of the generation
+            if profile != False:
+                record['profile'] = metrics
+            
+            # Accuracy of the surrogate on the offspring it kept
+            if surrogate != False:
+                record['surrogate'] = surr_accuracy
+            
+            # Feature positions & genomes over the original columns
+            if prefilter != False:
+                record['best_candidate']['features'] = idx_keep[record['best_candidate']['features']]
+                if top_k != False:
+                    record['top'] = dict(record['top'], genomes=f_prefilter_genomes(record['top']['genomes'], idx_keep, n_features_original))
+            
+            # Callbacks (any returning True stops the run)
+            stopped = False
+            for callback in callbacks:
+                if callback(record) == True:
+                    stopped = True
+            
+            # Conditionally stop
+            if gens_no_improve != False:
+                if count == gens_no_improve:
+                    stopped = True
+            
+            # Save run state
+            phase = f_phase_start(profile)
+            if checkpoint != False:
+                f_checkpoint_save(checkpoint, gen, pop_cur, history, cache, count, v_best, schedule, folds, 
+                                  pop_elite=pop_elite, stopped=stopped, surrogate=surr)
+            f_phase_end(metrics, 'checkpoint', phase)
+            
+            # Hand the record over (a new budget or migrants can be sent back)
+            command = yield record
+            if command is not None:
+                generations = command.get('generations', generations)
+                if (command.get('migrants', False) != False) and (prefilter != False):
+                    command = dict(command, migrants=dict(command['migrants'], genomes=command['migrants']['genomes'][:, idx_keep]))
+                if (command.get('migrants', False) != False) and (steady_state != False):
+                    pop_pool = f_population_migrate(pop_pool, command['migrants'], pairwise=diversity)
+                elif command.get('migrants', False) != False:
+                    pop_cur = f_population_migrate(pop_cur, command['migrants'], pairwise=diversity)
+            
             # Conditionally break loop
-            if count == gens_no_improve:
+            if stopped:
                 break
+            gen += 1
+    finally:
+        # Stop worker pool
+        if pool != False:
+            f_pool_stop(pool)
+        if profile_trace:
+            tracemalloc.stop()
+    
+    # Genomes of the history over the original columns
+    if (prefilter != False) and (history != False):
+        history['fields']['genomes'] = f_prefilter_genomes(f_history_view(history)['genomes'], idx_keep, n_features_original)
+    
+    return history
+
+# Main Optimisation Function
+def f_model_optimisation(df, target_var, generations,  population, eval_metric, model, kfold=False, hyperparams_multiple = 3, hyperparams = False, 
+                         desiriability=False,p_crossover=0.8, p_mutate=0.01, hyperparams_increment = 0.1, elitism=False, gens_no_improve = False, initalise = False,
+                         cache_size = 10000, n_workers = 1, diversity = False, race = False, fidelity = False, fold_cache = True,
+                         checkpoint = False, resume_from = False, callbacks = False, seed = False, profile = False, prefilter = False,
+                         surrogate = False, steady_state = False, bin_folds = False):
+    '''Function uses GA's to choose features and tune hyperparameters'''
+    
+    # Print Model Stats
+    print('Model Initialisation')
+    if resume_from != False:
+        print('Resuming from ' + str(resume_from))
+    
+    # Print each generation before the user's callbacks
+    l_callbacks = [f_callback_print]
+    if callbacks != False:
+        l_callbacks += list(callbacks)
+    
+    # Run the search, the history is returned when the stream finishes
+    stream = f_model_optimisation_stream(df=df, target_var=target_var, generations=generations, population=population, eval_metric=eval_metric, 
+                                         model=model, kfold=kfold, hyperparams_multiple=hyperparams_multiple, hyperparams=hyperparams, 
+                                         desiriability=desiriability, p_crossover=p_crossover, p_mutate=p_mutate, 
+                                         hyperparams_increment=hyperparams_increment, elitism=elitism, gens_no_improve=gens_no_improve, 
+                                         initalise=initalise, cache_size=cache_size, n_workers=n_workers, diversity=diversity, race=race, 
+                                         fidelity=fidelity, fold_cache=fold_cache, checkpoint=checkpoint, resume_from=resume_from, 
+                                         callbacks=l_callbacks, seed=seed, profile=profile, keep_history=True, surrogate=surrogate,
+                                         steady_state=steady_state, prefilter=prefilter, bin_folds=bin_folds)
+    record = False
+    l_profile = []
+    l_surrogate = []
+    while True:
+        try:
+            record = next(stream)
+        except StopIteration as stop:
+            history = stop.value
+            break
+        if profile != False:
+            l_profile.append(dict(record['profile'], generation=record['generation']))
+        if (surrogate != False) and (record['surrogate'] != False):
+            l_surrogate.append(dict(record['surrogate'], generation=record['generation']))
+    
+    # Print Cache Stats
+    if (record != False) and (record['cache'] != False):
+        print('Cache - Hits:' + str(record['cache']['hits']) +
+              ' - Misses:' + str(record['cache']['misses']) +
+              ' - Hit Rate:' + str(round(record['cache']['hit_rate'], 4)))
+    
+    # Print Profile (total wall seconds of each phase)
+    if len(l_profile) > 0:
+        l_phases = ['generate', 'screen', 'evaluate', 'surrogate', 'best_variant', 'similarity', 'history', 'checkpoint']
+        print('Profile -' + ' -'.join(' ' + phase + ':' + str(round(sum(gen_profile[phase]['wall'] for gen_profile in l_profile if phase in gen_profile), 2)) + 's' 
+                                        for phase in l_phases) +
+              ' - Fit Time:' + str(round(sum(gen_profile['fit_time']['total'] for gen_profile in l_profile), 2)) + 's')
+    
+    # Build output dataframe (feature positions & hyperparameter dictionaries)
+    df_output = f_history_to_frame(history, hyperparams)
+    
+    # Phase metrics of each generation
+    if profile != False:
+        df_output.attrs['profile'] = l_profile
+    
+    # Surrogate accuracy of each generation
+    if surrogate != False:
+        df_output.attrs['surrogate'] = l_surrogate
+
+    return df_output
+
+"""**ISLAND MODEL**
+
+A single population converges quickly (see the similarity_features plots) and a larger population makes every generation slower. Instead the search can be split over several islands, each a sub-population run by f_model_optimisation_stream in its own process with its own settings (e.g. crossover & mutation rates). Every migration_interval generations each island sends its top migration_size candidates to the next island, where they replace the weakest candidates:
+
+* ring - island i always sends to island i + 1
+* random - a new random ring of the islands for every migration
+
+Islands only wait for each other at migrations so the search scales with the number of cores. The histories of the islands are merged into the usual output dataframe with an extra island column. Settings which add output columns (racing, fidelity, diversity) should be the same on every island, checkpoints are not supported in island mode.
+
+islands = 4 or [{'p_mutate':0.01}, {'p_mutate':0.05}, {'p_crossover':0.5}, {'p_crossover':0.9}]
+"""
+
+# Islands to send to & receive from at a migration
+def f_migration_route(island, n_islands, gen, migration):
+    '''Destination & source island on the ring of the migration'''
+    if migration['topology'] == 'random':
+        order = np.random.RandomState([migration['seed'], gen]).permutation(n_islands)
+    else:
+        order = np.arange(n_islands)
+    position = int(np.flatnonzero(order == island)[0])
+    return int(order[(position + 1) % n_islands]), int(order[(position - 1) % n_islands])
 
+# Run one island inside its own process
+def f_island_worker(island, settings, migration, inboxes, results, seed):
+    '''Runs the stream of an island, exchanging migrants at every migration'''
+    
+    # Each island needs its own random numbers
+    rnd.seed(seed)
+    
+    try:
+        stream = f_model_optimisation_stream(**settings, top_k=migration['size'])
+        l_done = []
+        d_arrived = {}
+        command = None
+        record = False
+        while True:
+            try:
+                record = stream.send(command)
+            except StopIteration as stop:
+                history = stop.value
+                break
+            print('Island: ' + str(island) + ' - ' + f_record_text(record))
+            command = None
+            
+            # Migration
+            gen = record['generation']
+            if (gen > 0) and (gen % migration['interval'] == 0):
+                destination, source = f_migration_route(island, len(inboxes), gen, migration)
+                inboxes[destination].put((gen, island, record['top']))
+                
+                # Wait for the migrants of this generation (unless the source island has finished)
+                while (gen not in d_arrived) and (source not in l_done):
+                    gen_msg, island_msg, migrants = inboxes[island].get()
+                    if gen_msg is None:
+                        l_done.append(island_msg)
+                    else:
+                        d_arrived[gen_msg] = migrants
+                if gen in d_arrived:
+                    command = {'migrants':d_arrived.pop(gen)}
+        
+        # Print Cache Stats
+        if (record != False) and (record['cache'] != False):
+            print('Island: ' + str(island) + ' - Cache - Hits:' + str(record['cache']['hits']) +
+                  ' - Misses:' + str(record['cache']['misses']) +
+                  ' - Hit Rate:' + str(round(record['cache']['hit_rate'], 4)))
+        results.put(('history', island, f_history_view(history)))
+    except Exception:
+        results.put(('error', island, traceback.format_exc()))
+    finally:
+        # Let the other islands stop waiting for this one
+        for inbox in inboxes:
+            inbox.put((None, island, None))
+
+# Island Optimisation Function
+def f_island_optimisation(df, target_var, generations,  population, eval_metric, model, islands = 4, 
+                          migration_interval = 5, migration_size = 2, topology = 'ring', prefilter = False, **kwargs):
+    '''Runs the GA on several islands in parallel with periodic migration (other settings as f_model_optimisation)'''
+    
+    # Print Model Stats
+    print('Model Initialisation')
+    if ('checkpoint' in kwargs) or ('resume_from' in kwargs):
+        raise ValueError('Checkpoints are not supported in island mode')
+    
+    # Drop constant, duplicated & correlated columns once for every island (genomes are mapped back at the end)
+    if prefilter != False:
+        n_features_original = df.shape[1] - 1
+        df, initalise, idx_keep = f_prefilter_apply(df, target_var, prefilter, initalise=kwargs.get('initalise', False))
+        if initalise != False:
+            kwargs = dict(kwargs, initalise=initalise)
+    
+    # Settings of each island
+    if isinstance(islands, int):
+        islands = [{}] * islands
+    settings = dict(kwargs, df=df, target_var=target_var, generations=generations, population=population,
+                    eval_metric=eval_metric, model=model, keep_history=True)
+    
+    # Fork so the islands inherit the functions defined in this notebook
+    if 'fork' in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context('fork')
+    else:
+        mp_context = multiprocessing.get_context()
+    
+    # Seeds of the islands & the random topology
+    if kwargs.get('seed', False) is not False:
+        seeds = f_rng(kwargs['seed']).integers(0, 2**31 - 1, size=len(islands) + 1)
+        islands = [dict(island_settings, seed=int(island_seed)) for island_settings, island_seed in zip(islands, seeds)]
+    else:
+        seeds = rnd.randint(0, 2**31 - 1, size=len(islands) + 1)
+    migration = {'interval':migration_interval, 'size':migration_size, 'topology':topology, 'seed':int(seeds[-1])}
+    
+    # Start the islands
+    inboxes = [mp_context.Queue() for _ in islands]
+    results = mp_context.Queue()
+    l_processes = []
+    for island, island_settings in enumerate(islands):
+        process = mp_context.Process(target=f_island_worker,
+                                     args=(island, dict(settings, **island_settings), migration, inboxes, results, int(seeds[island])))
+        process.start()
+        l_processes.append(process)
+    
+    # Collect the history of each island
+    l_pops = [None] * len(islands)
+    l_errors = []
+    for _ in islands:
+        status, island, payload = results.get()
+        if status == 'error':
+            l_errors.append('Island ' + str(island) + ':\n' + payload)
+        else:
+            payload['island'] = np.full(len(payload['candidate']), island, dtype=np.int64)
+            l_pops[island] = payload
+    
+    # Let the islands exit (migrants sent to finished islands are discarded)
+    while any(process.is_alive() for process in l_processes):
+        for inbox in inboxes:
+            while not inbox.empty():
+                inbox.get()
+        for process in l_processes:
+            process.join(timeout=0.1)
+    if len(l_errors) > 0:
+        raise RuntimeError('\n'.join(l_errors))
+    
+    # Merge into one output dataframe (feature positions & hyperparameter dictionaries)
+    pop_output = f_population_concat(l_pops)
+    if prefilter != False:
+        pop_output['genomes'] = f_prefilter_genomes(pop_output['genomes'], idx_keep, n_features_original)
+    df_output = f_population_to_frame(pop_output, kwargs.get('hyperparams', False))
+    
     return df_output
 
 """Model Optimisation
@@ -748,7 +2900,7 @@ The output below shows the performance of the model of the generations, we can s
 # Run Optimisation - Optimise for AUC
 df_ENet_AUC = f_model_optimisation(df=df_train, target_var='TARGET', generations=7, population=20, p_crossover=0.8,
                                    p_mutate=0.02, hyperparams_increment=0.01, hyperparams_multiple = 5, eval_metric='roc_auc',
-                                   kfold=False, model=ElasticNet(), hyperparams = { 'names':['alpha', 'l1_ratio'],
+                                   kfold=kfold, prefilter={'variance':0, 'correlation':0.99}, model=ElasticNet(), hyperparams = { 'names':['alpha', 'l1_ratio'],
                                                                                     'min_value': [0, 0],
                                                                                     'max_value': [0.01, 1],
                                                                                     'type':['float', 'float']
@@ -783,13 +2935,14 @@ df_xgb_AUC = f_model_optimisation(df=df_train,
                                   hyperparams_increment=0.01,
                                   hyperparams_multiple = 5,
                                   eval_metric='roc_auc',
-                                  kfold=False,
+                                  kfold=kfold,
+                                  prefilter={'variance':0, 'correlation':0.99},
                                   model=XGBClassifier(objective="binary:logistic", scale_pos_weight = 25),
                                   hyperparams = {'names':['learning_rate', 'max_depth', 
                                                           'min_child_weight', 'gamma', 'colsample_bytree'],
                                                  'min_value': [0.03, 2,  1, 0,   0.3],
                                                  'max_value': [0.3,  15, 7, 0.5, 0.7],
-                                                 'type':['float', 'int', 'int', 'float', 'float']}
+                                                 'type':['float', 'int', 'int', 'float', 'float']})
 
 """Analysis Findings
 The results for all candidate models assessed by the GA were stored and now can be investigated. The graphic below shows the mean and max AUC achieved by each model across the generations. We can see that the mean scores across the generations are generally increasing indicating that the GA is driving towards more similar solutions across generations. The max score doesn't necessarily increase between generations as it reflects accepting worse solutions to enter new parts of the search space.
@@ -935,7 +3088,7 @@ model_en.set_params(**hyperparameters_en)
 model_en.fit(df_train.iloc[:,l_best_features_en], df_train.TARGET)
 
 # Predict on validation
-y_pred_en = model_en.predict(df_validation.iloc[:,l_best_features_en])
+y_pred_en = model_en.predict(df_val.iloc[:,l_best_features_en])
 
 # XGBOOST 
 # Extract best solution
@@ -963,21 +3116,21 @@ model_xg.set_params(**hyperparameters_xg)
 model_xg.fit(df_train.iloc[:,l_best_features_xg], df_train.TARGET)
 
 # Predict on validation
-y_pred_temp = ((model_xg.predict_proba(df_validation.iloc[:,l_best_features_xg])).tolist())
+y_pred_temp = ((model_xg.predict_proba(df_val.iloc[:,l_best_features_xg])).tolist())
 y_pred_xg = []
-for i in range(len(df_validation)):
+for i in range(len(df_val)):
     y_pred_xg.append(y_pred_temp[i][1])
 
 # Evaluation scores
 print('ElasticNET')
 print('Train Set AUC:', round((df_best_en.evaluation_score.tolist())[0], 3))
-print('Validation Set AUC:', round(metrics.roc_auc_score(df_validation.TARGET, y_pred_en), 3))
+print('Validation Set AUC:', round(metrics.roc_auc_score(df_val.TARGET, y_pred_en), 3))
 print(' ')
 
 # Evaluation scores
 print('XGBOOST')
 print('Train Set AUC:', round((df_best_xg.evaluation_score.tolist())[0], 3))
-print('Validation Set AUC:', round(metrics.roc_auc_score(df_validation.TARGET, y_pred_xg), 3))
+print('Validation Set AUC:', round(metrics.roc_auc_score(df_val.TARGET, y_pred_xg), 3))
 
 """Conclusion
 To conclude, GA appears to be a useful tool to apply both feature selection and hyperparameter tuning. The main drawback found during this process is the computational commitment required, while my code can 100% be optimised it is a relatively significant time committment. Taking the execution point out of consideration for the moment the GA does typically drive the modelling solution in the right areas of the search space.
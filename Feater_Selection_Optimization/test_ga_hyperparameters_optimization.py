@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""GA Tests
+
+Regression tests for ga_hyperparameters_optimization.py, run offline on small synthetic data (the notebook definitions are loaded the same way as the benchmarks):
+
+python -m pytest test_ga_hyperparameters_optimization.py
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.exceptions import FitFailedWarning
+from sklearn.base import clone
+from sklearn.linear_model import ElasticNet, Lasso, LogisticRegression
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import cross_val_score
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+from xgboost import XGBClassifier
+
+from benchmark_ga import f_load_ga, f_synthetic_data
+
+HYPERPARAMS = {'names':['logisticregression__C'], 'min_value':[0.01], 'max_value':[1.0], 'type':['float']}
+
+@pytest.fixture(scope='module')
+def ga():
+    return f_load_ga()
+
+@pytest.fixture(scope='module')
+def df():
+    return f_synthetic_data(600, n_features=20, p_positive=0.2, seed=7)
+
+# Small seeded search (3 generations of 6 candidates)
+def f_run(ga, df, seed=11, **kwargs):
+    return ga.f_model_optimisation(df=df, target_var='TARGET', generations=3, population=6, eval_metric='roc_auc',
+                                   model=make_pipeline(StandardScaler(), LogisticRegression()), hyperparams_multiple=2, hyperparams=HYPERPARAMS,
+                                   p_mutate=0.05, elitism=1, seed=seed, **kwargs)
+
+# Two runs produced the same history
+def f_same_run(df_a, df_b):
+    return ((df_a.shape == df_b.shape) and 
+            all(df_a[column].equals(df_b[column]) for column in df_a.columns if column not in ['features', 'hyperparameters']) and
+            all(np.array_equal(features_a, features_b) for features_a, features_b in zip(df_a['features'], df_b['features'])) and
+            [hyperparams['value'] for hyperparams in df_a['hyperparameters']] == [hyperparams['value'] for hyperparams in df_b['hyperparameters']])
+
+"""**DATASET CACHE**"""
+
+# The memory mapped cache holds the CSV's values & index in the smallest exact types, and is rebuilt when the CSV changes
+def test_dataset_cache(ga, tmp_path):
+    path_csv = str(tmp_path / 'data.csv')
+    df_csv = pd.DataFrame({'ID':[10, 11, 12, 13], 'var1':[1, -5, 100, 7], 'var2':[0.1, 0.2, 0.3, np.nan], 'var3':[0.5, 0.25, 1.5, 2.0],
+                           'var4':[1.0, 2.0, 3.0, 400.0], 'var5':['a', 'b', 'c', 'a'], 'TARGET':[0, 1, 0, 1]})
+    df_csv.to_csv(path_csv, index=False)
+    
+    df_cache = ga.f_load_dataset(path_csv, index_col='ID')
+    assert os.path.isfile(str(tmp_path / 'data_cache' / 'meta.json'))
+    pd.testing.assert_frame_equal(df_cache, pd.read_csv(path_csv, index_col='ID'), check_dtype=False, check_index_type=False)
+    assert df_cache.index.name == 'ID'
+    assert [dtype.name for dtype in df_cache.dtypes[:4]] == ['int8', 'float64', 'float32', 'int16']
+    
+    # Loaded again from the cache, then rebuilt from a changed CSV
+    pd.testing.assert_frame_equal(ga.f_load_dataset(path_csv, index_col='ID'), df_cache)
+    pd.concat([df_csv, df_csv.assign(ID=df_csv['ID'] + 4, var1=-1)]).to_csv(path_csv, index=False)
+    df_cache = ga.f_load_dataset(path_csv, index_col='ID')
+    pd.testing.assert_frame_equal(df_cache, pd.read_csv(path_csv, index_col='ID'), check_dtype=False, check_index_type=False)
+    assert list(df_cache.index) == list(range(10, 18))
+
+"""**PREPROCESSING**"""
+
+# The preprocessor is fitted once on the train split and reused from the cache until a split changes
+def test_preprocess_cache(ga, df, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'preprocessed_cache')
+    d_frames = {'train':df.iloc[:400], 'val':df.iloc[400:500], 'test':df.iloc[500:].drop(columns='TARGET')}
+    l_fits = []
+    f_preprocess_fit = ga.f_preprocess_fit
+    monkeypatch.setattr(ga, 'f_preprocess_fit', lambda df, target_var: l_fits.append(len(df)) or f_preprocess_fit(df, target_var))
+    
+    d_output, _ = ga.f_preprocess(d_frames, 'TARGET', cache_dir=cache_dir)
+    d_cached, preprocessor = ga.f_preprocess(d_frames, 'TARGET', cache_dir=cache_dir)
+    assert l_fits == [400]
+    for name in d_frames:
+        pd.testing.assert_frame_equal(d_cached[name], d_output[name])
+    pd.testing.assert_frame_equal(d_cached['val'], ga.f_preprocess_transform(f_preprocess_fit(d_frames['train'], 'TARGET'), d_frames['val']), check_dtype=False)
+    
+    # A changed split refits the preprocessor
+    d_frames['val'] = d_frames['val'].assign(var1=d_frames['val']['var1'] + 1)
+    d_changed, _ = ga.f_preprocess(d_frames, 'TARGET', cache_dir=cache_dir)
+    assert l_fits == [400, 400]
+    assert not d_changed['val'].equals(d_cached['val'])
+    pd.testing.assert_frame_equal(d_changed['train'], d_cached['train'])
+
+"""**PREFILTER**"""
+
+# Feature positions of a prefiltered search refer to the columns of the original data
+def test_prefilter_positions(ga, df):
+    df_wide = df.assign(const=1.0, dup=df.iloc[:, 0])
+    df_wide = df_wide[['dup', 'const'] + list(df.columns)]
+    features, target = df_wide.drop(columns='TARGET'), df_wide['TARGET']
+    idx_keep, _ = ga.f_prefilter_features(features)
+    assert (0 in idx_keep) and (1 not in idx_keep) and (2 not in idx_keep)
+    
+    df_output = f_run(ga, df_wide, prefilter={'variance':0, 'correlation':0.99})
+    assert all(np.isin(feature_idx, idx_keep).all() for feature_idx in df_output['features'])
+    
+    # The best candidates score the same on the original columns
+    model = make_pipeline(StandardScaler(), LogisticRegression())
+    for _, row in df_output.nlargest(3, 'evaluation_score').iterrows():
+        score = ga.f_fitness(model, 'roc_auc', features, target, row['features'], False, row['hyperparameters'])
+        assert np.isclose(score.mean(), row['evaluation_score'])
+
+"""**MUTATION**"""
+
+# The variants of a candidate keep one genome, so they are evaluated as one batch
+def test_mutate_population_shares_genome(ga):
+    genomes = np.repeat(np.zeros((4, 50), dtype=bool), 3, axis=0)
+    values = np.full((12, 1), 0.5)
+    candidate = np.repeat(np.arange(4), 3)
+    genomes, values = ga.f_mutate_population(genomes, values, 0.5, HYPERPARAMS, 0.1, streams=ga.f_rng_generation(1, 1, 4)['candidate'], candidate=candidate)
+    assert len(np.unique(genomes, axis=0)) == 4
+    assert all(np.array_equal(genomes[i], genomes[3 * (i // 3)]) for i in range(12))
+
+"""**DESIRABILITY**"""
+
+# The default objectives score as the original comprehension, including values outside the bounds with s=0
+@pytest.mark.parametrize('s', [[0, 0], [1, 1], [2, 0.5]])
+def test_desirability_baseline(ga, s):
+    desiriability = {'lb':[0.6, 5], 'ub':[0.9, 15], 's':s}
+    pop = {'evaluation_score':np.array([0.5, 0.6, 0.7, 0.9, 0.95, 0.8]), 'feature_size':np.array([3, 5, 10, 15, 20, 12])}
+    desire_eval = [0 if x < 0.6 else 1 if x > 0.9 else ((x-0.6)/(0.9-0.6))**s[0] for x in pop['evaluation_score']]
+    desire_features = [0 if x > 15 else 1 if x < 5 else ((x-15)/(5-15))**s[1] for x in pop['feature_size']]
+    expected = (np.array(desire_features) * np.array(desire_eval))**0.5
+    assert np.allclose(ga.f_desirability(pop, desiriability), expected)
+
+"""**SURROGATE**"""
+
+# Only the crossover offspring are multiplied for screening
+def test_generate_population_crossover_multiple(ga):
+    features_name = ['var' + str(j) for j in range(20)]
+    pop = ga.f_generate_population(inital_flag=True, population=10, features_name=features_name, p_crossover=0.7, p_mutate=0.02,
+                                   hyperparams=HYPERPARAMS, hyperparams_increment=0.1, hyperparams_multiple=2,
+                                   rng=ga.f_rng_generation(1, 0, 10))
+    pop['fitness_score'] = np.linspace(0.5, 0.9, len(pop['candidate']))
+    pop = ga.f_sim_n_prob(ga.f_population_best_variant(pop))
+    child = ga.f_generate_population(inital_flag=False, population=9, features_name=features_name, df=pop, p_crossover=0.7, p_mutate=0.02,
+                                     hyperparams=HYPERPARAMS, hyperparams_increment=0.1, hyperparams_multiple=2,
+                                     rng=ga.f_rng_generation(1, 1, 45), crossover_multiple=5)
+    candidate = np.unique(child['candidate'])
+    assert np.array_equal(candidate, np.arange(6 * 5 + 3))
+
+# Screening runs when the survivors outnumber a multiplied parent pool (p_crossover below 0.8)
+@pytest.mark.parametrize('p_crossover', [0.5, 0.7])
+def test_surrogate_screen_low_crossover(ga, df, p_crossover):
+    stream = ga.f_model_optimisation_stream(df=df, target_var='TARGET', generations=4, population=10, eval_metric='roc_auc',
+                                            model=make_pipeline(StandardScaler(), LogisticRegression()), hyperparams_multiple=2, hyperparams=HYPERPARAMS,
+                                            p_crossover=p_crossover, p_mutate=0.02, elitism=1, seed=3, surrogate={'min_rows':10})
+    l_records = list(stream)
+    assert len(l_records) == 4
+    assert any(record['surrogate'] != False for record in l_records)
+
+"""**RACING**"""
+
+# A fold which fails to fit warns and scores 0, a variant for which every fit fails raises (as with cross_val_score)
+def test_fit_failures(ga, df):
+    features, target = df.drop(columns='TARGET'), df['TARGET']
+    model = make_pipeline(StandardScaler(), LogisticRegression())
+    genome = np.ones(features.shape[1], dtype=bool)
+    folds = ga.f_fold_cache(features, target, False, model)
+    folds[0] = dict(folds[0], y_train=np.zeros_like(folds[0]['y_train']))
+    with pytest.warns(FitFailedWarning):
+        results = ga.f_fitness(model, 'roc_auc', features, target, genome, False, False, folds=folds)
+    assert (results[0] == 0) and (results[1:] > 0.5).all()
+    
+    hyperparams = {'name':['logisticregression__C'], 'value':[-1.0]}
+    with pytest.warns(FitFailedWarning), pytest.raises(ValueError, match='fits failed'):
+        ga.f_fitness(model, 'roc_auc', features, target, genome, False, hyperparams, folds=folds)
+    with pytest.warns(FitFailedWarning), pytest.raises(ValueError, match='fits failed'):
+        ga.f_fitness(model, 'roc_auc', features, target, genome, False, hyperparams, rows=np.ones(len(target), dtype=bool))
+
+"""**FOLD CACHE**"""
+
+# The Gram fit, warm started along the alphas, scores as cross_val_score on the same folds (Lasso has no l1_ratio)
+@pytest.mark.parametrize('model', [ElasticNet(l1_ratio=0.5, tol=1e-8), Lasso(tol=1e-8)])
+def test_gram_path(ga, df, model):
+    features, target = df.drop(columns='TARGET'), df['TARGET'].astype(float)
+    folds = ga.f_fold_cache(features, target, False, model)
+    assert 'gram' in folds[0]
+    
+    genome = np.zeros(features.shape[1], dtype=bool)
+    genome[:10] = True
+    l_alpha = [0.1, 0.01, 0.001]
+    l_output = ga.f_fitness_batch(model, 'r2', features, target, genome, False, [{'name':['alpha'], 'value':[alpha]} for alpha in l_alpha], folds=folds)
+    for (results, _), alpha in zip(l_output, l_alpha):
+        expected = cross_val_score(clone(model).set_params(alpha=alpha), features.iloc[:, :10], target, 
+                                   cv=[(fold['train'], fold['test']) for fold in folds], scoring='r2')
+        assert np.allclose(results, expected, atol=1e-6)
+
+# The Gram fit and the warm started fit on the fold's rows agree
+@pytest.mark.parametrize('model', [ElasticNet(l1_ratio=0.5, tol=1e-8), Lasso(tol=1e-8)])
+def test_gram_row_path(ga, df, model):
+    features, target = df.drop(columns='TARGET'), df['TARGET'].astype(float)
+    folds = ga.f_fold_cache(features, target, False, model)
+    folds_rows = [{name:value for name, value in fold.items() if name not in ['gram', 'Xy', 'X_mean', 'y_mean', 'y_gram']} for fold in folds]
+    
+    genome = np.zeros(features.shape[1], dtype=bool)
+    genome[5:15] = True
+    l_hyperparams = [{'name':['alpha'], 'value':[alpha]} for alpha in [0.001, 0.05, 0.01]]
+    l_gram = ga.f_fitness_batch(model, 'r2', features, target, genome, False, l_hyperparams, folds=folds)
+    l_rows = ga.f_fitness_batch(model, 'r2', features, target, genome, False, l_hyperparams, folds=folds_rows)
+    for (results_gram, _), (results_rows, _) in zip(l_gram, l_rows):
+        assert np.allclose(results_gram, results_rows, atol=1e-6)
+
+# Binned folds keep only the codes, and a candidate scores as XGBoost fitted on the codes
+def test_bin_folds(ga, df):
+    features, target = df.drop(columns='TARGET'), df['TARGET']
+    model = XGBClassifier(n_estimators=10, max_depth=2, n_jobs=1)
+    folds = ga.f_fold_cache(features, target, False, model, bin_folds=True)
+    assert ('B_train' in folds[0]) and ('X_train' not in folds[0])
+    assert 'B_train' not in ga.f_fold_cache(features, target, False, model)[0]
+    
+    genome = np.zeros(features.shape[1], dtype=bool)
+    genome[:8] = True
+    score = ga.f_fitness(model, 'roc_auc', features, target, genome, False, False, folds=folds[:1])
+    fold = folds[0]
+    fitted = clone(model).fit(fold['B_train'][:, :8], fold['y_train'])
+    assert np.isclose(score[0], get_scorer('roc_auc')(fitted, fold['B_test'][:, :8], fold['y_test']))
+    
+    # Hyperparameters which change the binning are refused
+    with pytest.raises(ValueError):
+        ga.f_fitness_batch(model, 'roc_auc', features, target, genome, False, [{'name':['max_bin'], 'value':[64]}], folds=folds)
+
+"""**RANDOM STREAMS**"""
+
+# The seed alone fixes the run (the global NumPy state is not used)
+def test_seed_reproducible(ga, df):
+    np.random.seed(0)
+    df_a = f_run(ga, df)
+    np.random.seed(1)
+    df_b = f_run(ga, df)
+    assert f_same_run(df_a, df_b)
+    assert not f_same_run(df_a, f_run(ga, df, seed=12))
+
+"""**CHECKPOINTS**"""
+
+# A run resumed from the checkpoint of an interrupted run matches the uninterrupted run
+def test_checkpoint_resume(ga, df, tmp_path, monkeypatch):
+    df_full = f_run(ga, df)
+    
+    # Interrupt the run once the first generation's checkpoint is written
+    f_checkpoint_save = ga.f_checkpoint_save
+    def f_checkpoint_crash(path, gen, *args, **kwargs):
+        f_checkpoint_save(path, gen, *args, **kwargs)
+        if gen == 1:
+            raise KeyboardInterrupt
+    monkeypatch.setattr(ga, 'f_checkpoint_save', f_checkpoint_crash)
+    with pytest.raises(KeyboardInterrupt):
+        f_run(ga, df, checkpoint=str(tmp_path / 'run.npz'))
+    monkeypatch.undo()
+    
+    np.random.seed(0)
+    df_resumed = f_run(ga, df, checkpoint=str(tmp_path / 'run.npz'), resume_from=str(tmp_path / 'run.npz'))
+    assert f_same_run(df_full, df_resumed)
+
+"""**PARALLEL EVALUATION**"""
+
+# Scoring in a pool of workers gives the same run as scoring in the main process (from the shared fold cache or the shared features)
+@pytest.mark.parametrize('fold_cache', [True, False])
+def test_workers_match_serial(ga, df, fold_cache):
+    assert f_same_run(f_run(ga, df, fold_cache=fold_cache), f_run(ga, df, fold_cache=fold_cache, n_workers=2))
+
+"""**STEADY STATE**"""
+
+# Children are numbered in dispatch order after the first generation, so candidate numbers are unique over the run
+def test_steady_state_candidates(ga, df):
+    df_output = f_run(ga, df, steady_state=True)
+    assert df_output['candidate'].is_unique
+    assert set(df_output.loc[df_output['generation'] > 0, 'candidate']) == set(range(6, 6 + 2 * 6))